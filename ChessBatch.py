@@ -0,0 +1,170 @@
+"""
+Headless batch analysis of FEN/EPD positions, no pygame needed.
+
+    python ChessBatch.py positions.epd                      analyze every line, results to stdout
+    python ChessBatch.py positions.epd -o results.tsv --depth 3 --workers 8
+    cat positions.fen | python ChessBatch.py -             read the positions from stdin
+
+Every line is a position as a FEN (6 fields) or an EPD (4 fields followed by operations, an id "..." operation is
+kept in the output). The output is one tab-separated line per position, in the order of the input:
+    line number, id, FEN, legal move count, status (checkmate, stalemate, check or -), score, best move
+Scores are in centipawns from the side to move's point of view. Lines that cannot be read get status "error".
+
+The input is read as a stream and sent to a pool of worker processes in chunks, with only a few chunks per worker in
+flight at a time, so memory stays flat however long the file is and results are written as they come in.
+"""
+import argparse
+import multiprocessing
+import sys
+from collections import deque
+
+from ChessEngine import GameState, W_KING, B_KING, move_to_uci
+from ChessEval import evaluate
+from ChessSearch import Searcher
+from ChessTransposition import TranspositionTable
+
+DEFAULT_DEPTH = 2
+DEFAULT_CHUNK = 256
+DEFAULT_HASH_MB = 4
+CHUNKS_PER_WORKER = 4 # Chunks sent to the pool ahead of the one being written, per worker
+
+HEADER = "line\tid\tfen\tmoves\tstatus\tscore\tbestmove"
+
+# Transposition table of a worker process, reused for every position it analyzes
+_table = None
+
+
+def parse_position(line):
+    """
+    Reads a FEN or EPD line, returns (game state, id), the id is "" if the line has none
+    """
+    fields = line.split()
+    if len(fields) < 4:
+        raise ValueError("not a FEN or EPD: " + line)
+
+    # A FEN has the halfmove clock and fullmove number after the 4 position fields, an EPD has operations
+    if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+        return GameState.from_fen(line), ""
+
+    game_state, operations = GameState.from_epd(line)
+    return game_state, " ".join(operations.get("id", []))
+
+
+def analyze(position, depth=DEFAULT_DEPTH, table=None):
+    """
+    Analyzes one position (a GameState or a FEN), returns (legal move count, status, score, best move in UCI notation)
+    With depth 0 the score is the static evaluation and there is no best move
+    """
+    game_state = GameState.from_fen(position) if isinstance(position, str) else position
+    if game_state.bitboards[W_KING].bit_count() != 1 or game_state.bitboards[B_KING].bit_count() != 1:
+        raise ValueError("each side needs one king: " + game_state.board_to_fen())
+
+    moves = game_state.legal_moves()
+    in_check = game_state.king_in_check(game_state.white_to_move)
+    if not moves:
+        return 0, "checkmate" if in_check else "stalemate", None, None
+
+    status = "check" if in_check else "-"
+    if depth <= 0:
+        return len(moves), status, evaluate(game_state), None
+
+    move, score, pv = Searcher(game_state, info=None, table=table).search(depth)
+    return len(moves), status, score, move_to_uci(move)
+
+
+def _init_worker(hash_mb):
+    global _table
+    _table = TranspositionTable(hash_mb)
+
+
+def analyze_chunk(chunk, depth):
+    """
+    Analyzes a chunk of (line number, line) pairs in a worker process, returns the output lines
+    """
+    table = _table if _table is not None else TranspositionTable(DEFAULT_HASH_MB)
+    output = []
+    for number, line in chunk:
+        try:
+            game_state, position_id = parse_position(line)
+            fen = game_state.board_to_fen()
+            move_count, status, score, best = analyze(game_state, depth, table)
+        except Exception:
+            # A malformed position (no king, too many squares, ...) must not end a batch of thousands
+            output.append(f"{number}\t\t{line}\t\terror\t\t")
+            continue
+
+        output.append(f"{number}\t{position_id}\t{fen}\t{move_count}\t{status}\t{'' if score is None else score}\t{best or ''}")
+
+    return output
+
+
+def read_chunks(lines, chunk_size):
+    # Groups the non empty, non comment lines into chunks of (line number, line) pairs
+    chunk = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        chunk.append((number, line))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def analyze_stream(lines, output, depth=DEFAULT_DEPTH, workers=None, chunk_size=DEFAULT_CHUNK, hash_mb=DEFAULT_HASH_MB):
+    """
+    Analyzes every position of an iterable of lines and writes the results to the output file as they finish
+    Returns the number of positions analyzed
+    """
+    workers = workers or multiprocessing.cpu_count()
+    count = 0
+    output.write(HEADER + "\n")
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(hash_mb,)) as pool:
+        in_flight = deque()
+        for chunk in read_chunks(lines, chunk_size):
+            in_flight.append(pool.apply_async(analyze_chunk, (chunk, depth)))
+
+            # Write the oldest chunk once enough work is queued, so the input is never read far ahead
+            if len(in_flight) >= workers * CHUNKS_PER_WORKER:
+                count += _write_results(in_flight.popleft().get(), output)
+
+        while in_flight:
+            count += _write_results(in_flight.popleft().get(), output)
+
+    return count
+
+
+def _write_results(results, output):
+    output.write("\n".join(results) + "\n")
+    output.flush()
+    return len(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a file of FEN/EPD positions")
+    parser.add_argument("input", help="file with one FEN or EPD per line, - for stdin")
+    parser.add_argument("-o", "--output", help="output file (tab-separated), stdout by default")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="search depth, 0 for the static evaluation only")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="positions sent to a worker at a time")
+    parser.add_argument("--hash", type=float, default=DEFAULT_HASH_MB, help="transposition table size per worker in MB")
+    args = parser.parse_args(argv)
+
+    lines = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        analyze_stream(lines, output, args.depth, args.workers, args.chunk, args.hash)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+        if output is not sys.stdout:
+            output.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Headless benchmarks for the engine in ChessEngine.
+
+    python ChessBench.py perft               perft on the standard positions, checked against the known node counts,
+                                             then the notation checks
+    python ChessBench.py notation            FEN/EPD round trips, castling rights cleaned up from a FEN, Polyglot keys,
+                                             PGN games without tags
+    python ChessBench.py perft --depth 3     the same with every position searched to depth 3
+    python ChessBench.py divide 2 "<fen>"    perft split by root move, to find where a wrong count comes from
+    python ChessBench.py search --hash 1 16  fixed depth searches with each transposition table size (MB)
+                                             and the share of cutoffs on the first move searched (move ordering)
+    python ChessBench.py smp --threads 1 4   fixed depth searches with each number of worker processes, and the speedup
+    python ChessBench.py eval --depth 2      evaluation of every position up to depth 2, one at a time and as a batch
+    python ChessBench.py replay games.pgn    reads and replays every game of a PGN file, in games and moves per second
+
+Every change to the move generator or the position setup should keep perft passing, and the nodes per second are the baseline
+performance changes are measured against.
+"""
+import argparse
+import io
+import sys
+import time
+
+import numpy as np
+
+from ChessBook import polyglot_key
+from ChessEngine import GameState, move_to_uci
+from ChessEval import evaluate, encode_positions, evaluate_batch
+from ChessPGN import read_games
+from ChessSearch import Searcher, ParallelSearcher
+from ChessTransposition import TranspositionTable
+from ChessUCI import parse_uci_move
+
+# (name, FEN, default depth, node counts at depth 1, 2, 3, ...)
+# Node counts from https://www.chessprogramming.org/Perft_Results
+PERFT_POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", 4,
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 3,
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", 5,
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", 3,
+     [6, 264, 9467, 422333, 15833292]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", 3,
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", 3,
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+
+
+# (FEN given, FEN written back): en passant squares no pawn can capture on and castling rights without the king and
+# rook on their starting squares are dropped
+FEN_CASES = [(fen, fen) for name, fen, default_depth, expected_counts in PERFT_POSITIONS] + [
+    ("rnbqkbnr/ppp1pppp/8/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3", "rnbqkbnr/ppp1pppp/8/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3"),
+    ("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1", "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"),
+    ("4k3/8/8/8/8/8/8/4K3 w KQkq - 0 1", "4k3/8/8/8/8/8/8/4K3 w - - 0 1"),
+    ("r3k3/8/8/8/8/8/8/4K2R w KQkq - 0 1", "r3k3/8/8/8/8/8/8/4K2R w Kq - 0 1"),
+    ("1r2k2r/8/8/8/8/8/8/R3K1R1 b KQkq - 5 40", "1r2k2r/8/8/8/8/8/8/R3K1R1 b Qk - 5 40"),
+]
+
+# (UCI moves from the start position, Polyglot key), the reference keys of the Polyglot book format specification
+POLYGLOT_KEYS = [
+    ("", 0x463B96181691FC9C),
+    ("e2e4", 0x823C9B50FD114196),
+    ("e2e4 d7d5", 0x0756B94461C50FB0),
+    ("e2e4 d7d5 e4e5", 0x662FAFB965DB29D4),
+    ("e2e4 d7d5 e4e5 f7f5", 0x22A48B5A8E47FF78),
+    ("e2e4 d7d5 e4e5 f7f5 e1e2", 0x652A607CA3F242C1),
+    ("e2e4 d7d5 e4e5 f7f5 e1e2 e8f7", 0x00FDD303C946BDD9),
+    ("a2a4 b7b5 h2h4 b5b4 c2c4", 0x3C8123EA7B067637),
+    ("a2a4 b7b5 h2h4 b5b4 c2c4 b4c3 a1a3", 0x5C3F9B829B279560),
+]
+
+
+# Games without tags in one stream, each ends at its result: (result, moves) of every game
+TAGLESS_PGN = "1. e4 e5 2. Nf3 Nc6 1-0\n1. e4 c5 2. Nf3 {Open Sicilian} d6 (2... Nc6) 3. d4 0-1 1. d4 d5 1/2-1/2\n"
+TAGLESS_GAMES = [("1-0", 4), ("0-1", 5), ("1/2-1/2", 2)]
+
+
+def run_perft(fen, depth):
+    """
+    Runs perft on a position, returns (nodes, seconds)
+    """
+    game_state = GameState.from_fen(fen)
+
+    tic = time.perf_counter()
+    nodes = game_state.perft(depth)
+    toc = time.perf_counter()
+
+    return nodes, toc - tic
+
+
+def perft_suite(depth=None):
+    """
+    Runs perft on every standard position and prints a line per position
+    Returns True if every node count matched
+    """
+    passed = True
+    total_nodes = 0
+    total_time = 0.0
+
+    for name, fen, default_depth, expected_counts in PERFT_POSITIONS:
+        position_depth = min(depth or default_depth, len(expected_counts))
+        expected = expected_counts[position_depth - 1]
+        nodes, seconds = run_perft(fen, position_depth)
+
+        total_nodes += nodes
+        total_time += seconds
+        ok = nodes == expected
+        passed = passed and ok
+
+        status = "OK" if ok else "FAIL (expected {})".format(expected)
+        print(f"{name:<10} depth {position_depth}  {nodes:>10} nodes  {seconds:8.3f} s  {nodes / seconds:>10.0f} nps  {status}")
+
+    print(f"{'total':<10}          {total_nodes:>10} nodes  {total_time:8.3f} s  {total_nodes / total_time:>10.0f} nps")
+    return passed
+
+
+def notation_suite():
+    """
+    Checks FEN and EPD round trips, the Polyglot keys against the reference values and reading games without tags,
+    prints a line per failure
+    Returns True if everything matched
+    """
+    failures = 0
+
+    for fen, expected in FEN_CASES:
+        game_state = GameState.from_fen(fen)
+        epd_state, operations = GameState.from_epd(game_state.board_to_epd({"id": "x"}))
+        # Every legal move must be playable, a castling move needs the rook it moves
+        try:
+            for move in game_state.legal_moves():
+                game_state.make_move(move)
+                game_state.unmake_move()
+        except IndexError:
+            print(f"FEN FAIL {fen}: cannot play {move_to_uci(move)}")
+            failures += 1
+            continue
+        if game_state.board_to_fen() != expected or game_state.zobrist_key != game_state.compute_zobrist_key():
+            print(f"FEN FAIL {fen}: {game_state.board_to_fen()} (expected {expected})")
+            failures += 1
+        elif epd_state.board_to_epd() != " ".join(expected.split()[:4]) or operations != {"id": ["x"]}:
+            print(f"EPD FAIL {fen}: {epd_state.board_to_epd()} {operations}")
+            failures += 1
+
+    for moves, expected in POLYGLOT_KEYS:
+        game_state = GameState.from_fen(PERFT_POSITIONS[0][1])
+        for text in moves.split():
+            game_state.make_move(parse_uci_move(game_state, text))
+        key = polyglot_key(game_state)
+        if key != expected:
+            print(f"POLYGLOT FAIL {moves or 'start'}: {key:016x} (expected {expected:016x})")
+            failures += 1
+
+    games = [(game.result, len(game.moves)) for game in read_games(io.StringIO(TAGLESS_PGN)) if game.error is None]
+    if games != TAGLESS_GAMES:
+        print(f"PGN FAIL games without tags: {games} (expected {TAGLESS_GAMES})")
+        failures += 1
+
+    print(f"notation   {len(FEN_CASES)} FENs  {len(POLYGLOT_KEYS)} Polyglot keys  {len(TAGLESS_GAMES)} PGN games  "
+          f"{'OK' if not failures else f'{failures} FAIL'}")
+    return failures == 0
+
+
+def divide(fen, depth):
+    """
+    Prints the perft count below each root move and the total
+    """
+    game_state = GameState.from_fen(fen)
+
+    counts = game_state.divide(depth)
+    for move in sorted(counts):
+        print(f"{move}: {counts[move]}")
+    print(f"\nmoves: {len(counts)}  nodes: {sum(counts.values())}")
+
+
+def search_suite(depth, hash_sizes):
+    """
+    Searches every standard position to a fixed depth with each transposition table size
+    and prints the time and table statistics, to tune memory against speed
+    """
+    for size_mb in hash_sizes:
+        total_nodes = 0
+        total_time = 0.0
+        probes = hits = overwrites = 0
+        cutoffs = first_move_cutoffs = 0
+
+        for name, fen, default_depth, expected_counts in PERFT_POSITIONS:
+            game_state = GameState.from_fen(fen)
+            searcher = Searcher(game_state, info=None, table=TranspositionTable(size_mb))
+
+            tic = time.perf_counter()
+            searcher.search(depth)
+            toc = time.perf_counter()
+
+            stats = searcher.table.stats()
+            total_nodes += searcher.nodes
+            total_time += toc - tic
+            probes += stats["probes"]
+            hits += stats["hits"]
+            overwrites += stats["overwrites"]
+            cutoffs += searcher.orderer.cutoffs
+            first_move_cutoffs += searcher.orderer.first_move_cutoffs
+
+        print(f"hash {size_mb:>5} MB  depth {depth}  {total_nodes:>9} nodes  {total_time:8.3f} s  {total_nodes / total_time:>8.0f} nps  "
+              f"hit rate {hits / probes if probes else 0:.3f}  overwrites {overwrites}  "
+              f"first move cutoffs {first_move_cutoffs / cutoffs if cutoffs else 0:.3f}")
+
+
+def smp_suite(depth, thread_counts, size_mb):
+    """
+    Searches every standard position to a fixed depth with each number of threads (worker processes)
+    and prints the time to depth and the speedup over the first thread count
+    """
+    baseline = None
+    for threads in thread_counts:
+        total_nodes = 0
+        total_time = 0.0
+        searcher = ParallelSearcher(threads, size_mb, info=None)
+
+        for name, fen, default_depth, expected_counts in PERFT_POSITIONS:
+            game_state = GameState.from_fen(fen)
+
+            tic = time.perf_counter()
+            searcher.search(game_state, depth)
+            toc = time.perf_counter()
+
+            total_nodes += searcher.nodes
+            total_time += toc - tic
+        searcher.close()
+
+        if baseline is None:
+            baseline = total_time
+        print(f"threads {threads:>3}  depth {depth}  {total_nodes:>9} nodes  {total_time:8.3f} s  {total_nodes / total_time:>8.0f} nps  "
+              f"speedup {baseline / total_time:.2f}")
+
+
+def eval_suite(depth):
+    """
+    Evaluates every position up to depth moves from the standard positions,
+    one call per position and with one evaluate_batch call (material and piece-square tables only)
+    """
+    boards = []
+    sides = []
+    evaluate_time = 0.0
+
+    def walk(game_state, depth):
+        nonlocal evaluate_time
+        tic = time.perf_counter()
+        evaluate(game_state)
+        evaluate_time += time.perf_counter() - tic
+
+        # The position is encoded now, the game state keeps changing
+        board, white_to_move = encode_positions([game_state])
+        boards.append(board[0])
+        sides.append(white_to_move[0])
+
+        if depth > 0:
+            for move in game_state.legal_moves():
+                game_state.make_move(move)
+                walk(game_state, depth - 1)
+                game_state.unmake_move()
+
+    for name, fen, default_depth, expected_counts in PERFT_POSITIONS:
+        game_state = GameState.from_fen(fen)
+        walk(game_state, depth)
+
+    positions = len(boards)
+    print(f"evaluate        {positions:>8} positions  {evaluate_time:8.3f} s  {positions / evaluate_time:>10.0f} positions/s")
+
+    boards = np.array(boards)
+    sides = np.array(sides)
+    tic = time.perf_counter()
+    evaluate_batch(boards, sides)
+    toc = time.perf_counter()
+    print(f"evaluate_batch  {positions:>8} positions  {toc - tic:8.3f} s  {positions / (toc - tic):>10.0f} positions/s")
+
+
+def replay(path):
+    """
+    Reads every game of a PGN file, resolving and playing each SAN move, and reports games and moves per second
+    """
+    games = 0
+    moves = 0
+    errors = 0
+    tic = time.perf_counter()
+    with open(path, encoding="utf-8", errors="replace") as stream:
+        for game in read_games(stream):
+            games += 1
+            moves += len(game.moves)
+            if game.error is not None:
+                errors += 1
+                print(f"game {games}: {game.error}")
+    toc = time.perf_counter()
+
+    elapsed = max(toc - tic, 1e-9)
+    print(f"{games} games  {moves} moves  {errors} errors  {elapsed:8.3f} s  {games / elapsed:>8.1f} games/s  {moves / elapsed:>8.0f} moves/s")
+    return errors == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Engine benchmarks and move generator checks")
+    commands = parser.add_subparsers(dest="command")
+
+    perft_parser = commands.add_parser("perft", help="run perft on the standard positions")
+    perft_parser.add_argument("--depth", type=int, help="search every position to this depth instead of its default")
+
+    commands.add_parser("notation", help="FEN/EPD round trips, Polyglot keys and PGN games without tags")
+
+    divide_parser = commands.add_parser("divide", help="perft split by root move")
+    divide_parser.add_argument("depth", type=int)
+    divide_parser.add_argument("fen", nargs="?", default=PERFT_POSITIONS[0][1])
+
+    search_parser = commands.add_parser("search", help="fixed depth searches of the standard positions")
+    search_parser.add_argument("--depth", type=int, default=4)
+    search_parser.add_argument("--hash", type=float, nargs="+", default=[16], help="transposition table sizes in MB")
+
+    smp_parser = commands.add_parser("smp", help="parallel search speedup on the standard positions")
+    smp_parser.add_argument("--depth", type=int, default=4)
+    smp_parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="numbers of worker processes")
+    smp_parser.add_argument("--hash", type=float, default=16, help="transposition table size in MB")
+
+    eval_parser = commands.add_parser("eval", help="evaluation speed, one position at a time and batched")
+    eval_parser.add_argument("--depth", type=int, default=2)
+
+    replay_parser = commands.add_parser("replay", help="PGN reading and replay speed")
+    replay_parser.add_argument("pgn", help="PGN file")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "notation":
+        return 0 if notation_suite() else 1
+
+    if args.command == "divide":
+        divide(args.fen, args.depth)
+        return 0
+
+    if args.command == "search":
+        search_suite(args.depth, args.hash)
+        return 0
+
+    if args.command == "smp":
+        smp_suite(args.depth, args.threads, args.hash)
+        return 0
+
+    if args.command == "eval":
+        eval_suite(args.depth)
+        return 0
+
+    if args.command == "replay":
+        return 0 if replay(args.pgn) else 1
+
+    # perft is the default command, the notation checks run with it
+    passed = perft_suite(getattr(args, "depth", None))
+    passed = notation_suite() and passed
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,95 @@
-import numpy as np
-import copy as cp
 import io
-import time
+import random
+import threading
+from array import array
+from collections import OrderedDict
+
+from ChessEval import PIECE_SQUARE, PHASE_WEIGHTS
+from ChessProfile import profiled, count
+
+# Squares are numbered rank * 8 + file using the same (rank, file) indices as the board,
+# so bit 0 is a8, bit 7 is h8 and bit 63 is h1
+FULL_BOARD = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL_BOARD ^ FILE_A
+NOT_FILE_H = FULL_BOARD ^ FILE_H
+RANK_8 = 0xFF
+RANK_7 = RANK_8 << 8
+RANK_6 = RANK_8 << 16
+RANK_3 = RANK_8 << 40
+RANK_2 = RANK_8 << 48
+RANK_1 = RANK_8 << 56
+PROMOTION_RANKS = RANK_8 | RANK_1
+
+# Piece indices, in the same order as piece_bitboards (white pieces are even, black pieces are odd)
+W_PAWN, B_PAWN, W_ROOK, B_ROOK, W_KNIGHT, B_KNIGHT = range(6)
+W_BISHOP, B_BISHOP, W_QUEEN, B_QUEEN, W_KING, B_KING = range(6, 12)
+PIECE_SYMBOLS = "PpRrNnBbQqKk"
+EMPTY = 12 # Value of an empty square in GameState.squares
+PIECE_FROM_SYMBOL = {symbol: index for index, symbol in enumerate(PIECE_SYMBOLS)}
+
+# Piece types (piece index // 2), also used as the promotion code of a move
+PAWN, ROOK, KNIGHT, BISHOP, QUEEN, KING = range(6)
+
+# Moves are stored as ints: from square | to square << 6 | promotion piece type << 12 | flags
+MOVE_PROMOTION_SHIFT = 12
+FLAG_EN_PASSANT = 1 << 15
+FLAG_CASTLE = 1 << 16
+FLAG_DOUBLE_PUSH = 1 << 17
+
+# Piece values by piece type for the static exchange evaluation (see), the king can never be won
+SEE_VALUES = [100, 500, 320, 330, 900, 20000]
+
+# Kinds of moves legal_moves can generate, noisy moves are captures (en passant included) and promotions
+MOVES_ALL, MOVES_NOISY, MOVES_QUIET = range(3)
+
+# Castling rights are bit flags, in the order of the FEN letters
+CASTLE_WHITE_KINGSIDE, CASTLE_WHITE_QUEENSIDE, CASTLE_BLACK_KINGSIDE, CASTLE_BLACK_QUEENSIDE = 1, 2, 4, 8
+ALL_CASTLING_RIGHTS = 15
+CASTLING_LETTERS = "KQkq"
+
+# Castling rights kept when a piece moves from or to a square, moving the king or a rook (or capturing a rook)
+# on its starting square removes castling on that side
+CASTLING_RIGHTS_KEPT = [ALL_CASTLING_RIGHTS] * 64
+for _square, _lost in ((0, CASTLE_BLACK_QUEENSIDE), (4, CASTLE_BLACK_KINGSIDE | CASTLE_BLACK_QUEENSIDE), (7, CASTLE_BLACK_KINGSIDE),
+                       (56, CASTLE_WHITE_QUEENSIDE), (60, CASTLE_WHITE_KINGSIDE | CASTLE_WHITE_QUEENSIDE), (63, CASTLE_WHITE_KINGSIDE)):
+    CASTLING_RIGHTS_KEPT[_square] = ALL_CASTLING_RIGHTS ^ _lost
+# Starting squares of the king and the rook each castling right needs, in the order of the flags
+CASTLING_SQUARES = ((60, 63), (60, 56), (4, 7), (4, 0))
 
 # Create bitboards for each type of piece for both colors
-# These bitboards will represent the position of each piece type
+# These bitboards will represent the position of each piece type in the starting position
 piece_bitboards = [
 # w_pawn 0
-int("0000000000000000000000000000000000000000000000001111111100000000", 2),
-#b_pawn 1
 int("0000000011111111000000000000000000000000000000000000000000000000", 2),
+#b_pawn 1
+int("0000000000000000000000000000000000000000000000001111111100000000", 2),
 
 #w_rook 2
-int("0000000000000000000000000000000000000000000000000000000010000001", 2),
-#b_rook 3
 int("1000000100000000000000000000000000000000000000000000000000000000", 2),
+#b_rook 3
+int("0000000000000000000000000000000000000000000000000000000010000001", 2),
 
 #w_knight 4
-int("0000000000000000000000000000000000000000000000000000000001000010", 2),
-#b_knight 5
 int("0100001000000000000000000000000000000000000000000000000000000000", 2),
+#b_knight 5
+int("0000000000000000000000000000000000000000000000000000000001000010", 2),
 
 #w_bishop 6
-int("0000000000000000000000000000000000000000000000000000000000100100", 2),
-#b_bishop 7
 int("0010010000000000000000000000000000000000000000000000000000000000", 2),
+#b_bishop 7
+int("0000000000000000000000000000000000000000000000000000000000100100", 2),
 
 #w_queen 8
-int("0000000000000000000000000000000000000000000000000000000000010000", 2),
+int("0000100000000000000000000000000000000000000000000000000000000000", 2),
 #b_queen 9
-int("0001000000000000000000000000000000000000000000000000000000000000", 2),
+int("0000000000000000000000000000000000000000000000000000000000001000", 2),
 
 #w_king 10
-int("0000000000000000000000000000000000000000000000000000000000001000", 2),
+int("0001000000000000000000000000000000000000000000000000000000000000", 2),
 #b_king 11
-int("0000100000000000000000000000000000000000000000000000000000000000", 2)
+int("0000000000000000000000000000000000000000000000000000000000010000", 2)
 ]
 
 # Create an empty bitboard 1: empty 0: piece present
@@ -43,55 +98,595 @@ empty_board = int("0000000000000000111111111111111111111111111111110000000000000
 
 # Define function that prints a bitboard
 def print_bitboard(bitboard):
-    board = '{:064b}'.format(bitboard)
-    for i in range(7, -1, -1):
-        row = board[i * 8:(i + 1) * 8]
-        print(" ".join(row))
-    
+    for rank in range(8):
+        row = (bitboard >> (rank * 8)) & 0xFF
+        print(" ".join("1" if row >> file & 1 else "0" for file in range(8)))
+
+
+def bitboard_to_squares(bitboard):
+    """
+    Converts a bitboard into a list of (rank, file) tuples
+    """
+    squares = []
+    while bitboard:
+        bit = bitboard & -bitboard
+        squares.append(divmod(bit.bit_length() - 1, 8))
+        bitboard ^= bit
+
+    return squares
+
+
+def _step_attacks(offsets):
+    # Builds a 64-entry table of the squares reached by a single step of each (rank, file) offset
+    table = []
+    for square in range(64):
+        rank, file = divmod(square, 8)
+        attacks = 0
+        for i, j in offsets:
+            if 0 <= rank + i < 8 and 0 <= file + j < 8:
+                attacks |= 1 << ((rank + i) * 8 + file + j)
+        table.append(attacks)
+
+    return table
+
+
+def _slide(square, occupied, directions):
+    # Walks each direction until the edge of the board or a blocker (the blocker is included)
+    rank, file = divmod(square, 8)
+    attacks = 0
+    for i, j in directions:
+        r, f = rank + i, file + j
+        while 0 <= r < 8 and 0 <= f < 8:
+            attacks |= 1 << (r * 8 + f)
+            if occupied >> (r * 8 + f) & 1:
+                break
+            r += i
+            f += j
+
+    return attacks
+
+
+def _line_mask(square, directions):
+    # Squares on the given lines that can block a slider, the last square of each line never blocks anything
+    rank, file = divmod(square, 8)
+    mask = 0
+    for i, j in directions:
+        r, f = rank + i, file + j
+        while 0 <= r + i < 8 and 0 <= f + j < 8:
+            mask |= 1 << (r * 8 + f)
+            r += i
+            f += j
+
+    return mask
+
+
+def _subsets(mask):
+    # Enumerates every subset of the mask (carry-rippler trick)
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if subset == 0:
+            break
+
+
+def _slider_tables(line_a, line_b):
+    """
+    Builds the attack lookup for a slider moving along two lines.
+    The two lines are independent of each other, so the attacks for every blocker configuration
+    are the union of the attacks along each line, which keeps the table build fast
+    """
+    masks = []
+    tables = []
+    for square in range(64):
+        mask_a = _line_mask(square, line_a)
+        mask_b = _line_mask(square, line_b)
+        attacks_a = [(occ, _slide(square, occ, line_a)) for occ in _subsets(mask_a)]
+        attacks_b = [(occ, _slide(square, occ, line_b)) for occ in _subsets(mask_b)]
+        masks.append(mask_a | mask_b)
+        tables.append({occ_a | occ_b: att_a | att_b for occ_a, att_a in attacks_a for occ_b, att_b in attacks_b})
+
+    return masks, tables
+
+
+KNIGHT_ATTACKS = _step_attacks([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS = _step_attacks([(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)])
+# Squares attacked by a pawn of each color (0 white, 1 black) standing on a square
+PAWN_ATTACKS = [_step_attacks([(-1, -1), (-1, 1)]), _step_attacks([(1, -1), (1, 1)])]
+
+# Sliding attacks are looked up by the blockers on the piece's lines: TABLE[square][occupied & MASK[square]]
+ROOK_MASKS, ROOK_TABLE = _slider_tables([(-1, 0), (1, 0)], [(0, -1), (0, 1)])
+BISHOP_MASKS, BISHOP_TABLE = _slider_tables([(-1, -1), (1, 1)], [(-1, 1), (1, -1)])
+
+
+def _between_table():
+    # BETWEEN[a][b] holds the squares strictly between a and b if they share a rank, file or diagonal
+    table = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        rank, file = divmod(square, 8)
+        for i, j in ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)):
+            between = 0
+            r, f = rank + i, file + j
+            while 0 <= r < 8 and 0 <= f < 8:
+                table[square][r * 8 + f] = between
+                between |= 1 << (r * 8 + f)
+                r += i
+                f += j
+
+    return table
+
+
+BETWEEN = _between_table()
+
+
+def rook_attacks(square, occupied):
+    return ROOK_TABLE[square][occupied & ROOK_MASKS[square]]
+
+
+def bishop_attacks(square, occupied):
+    return BISHOP_TABLE[square][occupied & BISHOP_MASKS[square]]
+
+
+def move_to_squares(move):
+    """
+    Unpacks an encoded move into ((old_rank, old_file), (new_rank, new_file))
+    """
+    return divmod(move & 63, 8), divmod(move >> 6 & 63, 8)
+
+
+def square_name(square):
+    # Square index -> algebraic name, square 0 is a8
+    return "abcdefgh"[square & 7] + str(8 - (square >> 3))
+
+
+def parse_square(name):
+    # Algebraic name -> square index
+    return (8 - int(name[1])) * 8 + "abcdefgh".index(name[0])
+
+
+def castling_to_string(rights):
+    # Castling rights in FEN notation, "-" for none
+    return "".join(letter for bit, letter in enumerate(CASTLING_LETTERS) if rights >> bit & 1) or "-"
+
+
+def parse_castling(field):
+    return sum(1 << CASTLING_LETTERS.index(letter) for letter in set(field) if letter in CASTLING_LETTERS)
+
+
+def castling_rights_on_board(bitboards, rights):
+    # The castling rights that are possible with the pieces on the board, the king and rook must be on their starting squares
+    for bit, (king, rook) in enumerate(CASTLING_SQUARES):
+        color = bit >> 1
+        if not (bitboards[W_KING + color] >> king & 1 and bitboards[W_ROOK + color] >> rook & 1):
+            rights &= ~(1 << bit)
+    return rights
+
+
+def move_to_uci(move):
+    """
+    Writes an encoded move in UCI long algebraic notation (e2e4, e7e8q)
+    """
+    promotion = move >> MOVE_PROMOTION_SHIFT & 7
+    return square_name(move & 63) + square_name(move >> 6 & 63) + (" rnbq"[promotion] if promotion else "")
+
+
+def parse_epd_operations(text):
+    """
+    Parses EPD operations like 'bm Qxf7#; id "scholar's mate";' into {"bm": ["Qxf7#"], "id": ["scholar's mate"]}
+    Operands in double quotes can contain spaces and semicolons
+    """
+    operations = {}
+    operation = []
+    operand = []
+    quoted = False
+    was_quoted = False
+
+    for char in text + ";":
+        if quoted:
+            if char == '"':
+                quoted = False
+            else:
+                operand.append(char)
+        elif char == '"':
+            quoted = True
+            was_quoted = True
+        elif char.isspace() or char == ";":
+            if operand or was_quoted:
+                operation.append("".join(operand))
+                operand = []
+                was_quoted = False
+            if char == ";" and operation:
+                operations[operation[0]] = operation[1:]
+                operation = []
+        else:
+            operand.append(char)
+
+    return operations
+
 
-""" 
+def format_epd_operations(operations):
+    # Inverse of parse_epd_operations, operands with spaces or semicolons (and every id) are quoted
+    text = []
+    for opcode, operands in operations.items():
+        if isinstance(operands, (str, int)):
+            operands = [operands]
+        operands = [f'"{operand}"' if opcode == "id" or any(char in str(operand) for char in ' ;') else str(operand) for operand in operands]
+        text.append(" ".join([opcode] + operands) + ";")
+
+    return " ".join(text)
+
+
+# Positions whose legal moves are kept by LegalMoveCache
+MOVE_CACHE_SIZE = 4096
+
+
+# Zobrist keys, the key of a position is the XOR of the keys of its pieces, castling rights and en passant file,
+# and the side to move key when black is to move. A fixed seed keeps the keys the same between runs
+_zobrist_random = random.Random(20240101)
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) for _ in range(64)] for _ in range(12)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+_castling_right_keys = [_zobrist_random.getrandbits(64) for _ in range(4)]
+# Key of every combination of castling rights, indexed by the rights flags
+ZOBRIST_CASTLING = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights >> _bit & 1:
+            ZOBRIST_CASTLING[_rights] ^= _castling_right_keys[_bit]
+
+
+class _BoardRow():
+    # One rank of the board view, reads and writes go straight to the game state
+    __slots__ = ("game_state", "rank")
+
+    def __init__(self, game_state, rank):
+        self.game_state = game_state
+        self.rank = rank
+
+    def __getitem__(self, file):
+        piece = self.game_state.squares[self.rank * 8 + file]
+        return None if piece == EMPTY else PIECE_SYMBOLS[piece]
+
+    def __setitem__(self, file, symbol):
+        self.game_state.set_piece((self.rank, file), symbol)
+
+    def __iter__(self):
+        return (None if piece == EMPTY else PIECE_SYMBOLS[piece] for piece in self.game_state.squares[self.rank * 8:self.rank * 8 + 8])
+
+    def __len__(self):
+        return 8
+
+
+class _BoardView():
+    """
+    Compatibility view of the bitboards as the old 8x8 array of piece symbols (None for empty squares)
+    board[rank][file] can be read and written like before
+    """
+    __slots__ = ("game_state",)
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+
+    def __getitem__(self, rank):
+        return _BoardRow(self.game_state, rank)
+
+    def __iter__(self):
+        return (_BoardRow(self.game_state, rank) for rank in range(8))
+
+    def __len__(self):
+        return 8
+
+
+class LegalMoveCache():
+    """
+    Legal moves of recently seen positions keyed by Zobrist key, the least recently used position is dropped when full
+    A move changes the key, so make_move needs nothing else to invalidate it, and taking a move back finds the old moves
+    One cache is shared by every GameState (the board in ChessMain and the copies its engine worker checks), so it is
+    locked for use from several threads
+    """
+
+    def __init__(self, size=MOVE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def moves(self, game_state):
+        """
+        Returns the legal moves of the position as a tuple, generated only if the position is not in the cache
+        """
+        key = game_state.zobrist_key
+        with self.lock:
+            moves = self.entries.get(key)
+            if moves is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count("movegen.cache_hits")
+                return moves
+            self.misses += 1
+        count("movegen.cache_misses")
+
+        moves = tuple(game_state.legal_moves())
+        with self.lock:
+            self.entries[key] = moves
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        return moves
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+"""
 This class will store the information about the current game state. It will determine legal moves.
 It will take an optional starting pos in fen notation. If start_pos is empty, it will use standard starting pos.
 """
 class GameState():
+    # Fixed attributes keep every game state small, analysis keeps millions of them in memory
+    __slots__ = ("bitboards", "occupancy", "occupied", "squares", "white_to_move", "en_passant", "can_castle",
+                 "starting_pos", "white_promote", "black_promote", "zobrist_key", "key_history", "halfmove_clock",
+                 "fullmove_number", "psqt", "phase", "king_squares", "attack_maps", "undo_stack")
 
     def __init__(self, start_pos=None):
-        
-        # Board is represented by 2D numpy array
-        # White Pieces will be capital chars: P, R, N, B, K, Q
-        # Black Pieces will be lowercase chars: p, r, n, b, k, q
-        self.board = np.array([[None] * 8 for _ in range(8)])
+
+        # Board is represented by 12 bitboards, one for each piece type of each color (see piece_bitboards)
+        # plus an occupancy bitboard for each color and one for all pieces
+        # squares mirrors the bitboards as 64 bytes of piece indices (EMPTY for empty squares)
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0] # [white pieces, black pieces]
+        self.occupied = 0
+        self.squares = bytearray([EMPTY]) * 64
         self.white_to_move = True # White's move -> True, Black's move -> False
-        self.last_move = None # stored as [(x,y), piece_type, (x,y)]
-        self.can_castle = "KQkq" # K means white can kingside castle, Q means black can queenside castle, etc.
-        self.starting_pos = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+        self.en_passant = None # Square a pawn can capture en passant on, set after a pawn moves 2 squares next to an enemy pawn
+        self.can_castle = ALL_CASTLING_RIGHTS # Castling rights as CASTLE_* bit flags
+        self.starting_pos = start_pos if start_pos else "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
         self.white_promote = False # Used to tell ChessMain to display options for promotion
         self.black_promote = False
-        self.positions = {"rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR KQkq": 1} # Used to check for 3-fold repetition
+        self.zobrist_key = 0 # 64-bit Zobrist key of the position, updated with every move
+        self.key_history = array("Q") # Keys of the positions before the current one, used to check for 3-fold repetition
+        self.halfmove_clock = 0 # Moves since the last capture or pawn move, older positions can never repeat
+        self.fullmove_number = 1 # Starts at 1 and goes up after every black move
+        # Material and piece-square score (packed, see ChessEval) and game phase, updated with every piece added or removed
+        self.psqt = 0
+        self.phase = 0
+        # Square of each king [white, black], -1 if the color has no king (only possible while editing a board)
+        self.king_squares = [-1, -1]
+        # Squares attacked by each color [white, black], None until they are needed
+        self.attack_maps = [None, None]
+        # Undo records of the moves played,
+        # as (move, piece, captured, can_castle, en_passant, halfmove_clock, zobrist_key, attack_maps)
+        self.undo_stack = []
+
+
+    @property
+    def board(self):
+        """
+        Board as an 8x8 grid of piece symbols
+        White Pieces are capital chars: P, R, N, B, K, Q
+        Black Pieces are lowercase chars: p, r, n, b, k, q
+        """
+        return _BoardView(self)
+
+
+    @property
+    def last_move(self):
+        # stored as [(x,y), piece_type, (x,y)]
+        if not self.undo_stack:
+            return None
+
+        move, piece = self.undo_stack[-1][:2]
+        old_pos, new_pos = move_to_squares(move)
+        return [old_pos, PIECE_SYMBOLS[piece], new_pos]
 
 
-    def place_pieces_from_fen(self):
+    def place_pieces_from_fen(self, fen=None):
         """
-        Takes an string representation of the chessboard in FEN notation and 
-        sets up the chess board array accordingly
+        Takes an string representation of the chessboard in FEN notation (starting_pos if no fen is given) and
+        sets up the bitboards accordingly, along with the side to move, castling rights, en passant square and move clocks
+        Only the piece placement is required, a FEN without the other fields is white to move with all castling rights
         """
-        fen_board = self.starting_pos.split(" ")[0]
-        file = 0
-        rank = 0
+        if fen:
+            self.starting_pos = fen
+        fields = self.starting_pos.split()
+
+        bitboards = [0] * 12
+        squares = bytearray([EMPTY]) * 64
+        zobrist_key = psqt = phase = 0
+
+        # Ranks are listed from the 8th to the 1st, in square order, so the '/' separators can be skipped
+        # Pieces are added inline instead of with add_piece, loading many positions is this loop
+        square = 0
+        for symbol in fields[0]:
+            if symbol in "12345678":
+                square += ord(symbol) - 48
+            elif symbol != "/":
+                piece = PIECE_FROM_SYMBOL[symbol]
+                bitboards[piece] |= 1 << square
+                squares[square] = piece
+                zobrist_key ^= ZOBRIST_PIECES[piece][square]
+                psqt += PIECE_SQUARE[piece][square]
+                phase += PHASE_WEIGHTS[piece]
+                square += 1
+
+        self.bitboards = bitboards
+        self.squares = squares
+        self.occupancy = [bitboards[0] | bitboards[2] | bitboards[4] | bitboards[6] | bitboards[8] | bitboards[10],
+                          bitboards[1] | bitboards[3] | bitboards[5] | bitboards[7] | bitboards[9] | bitboards[11]]
+        self.occupied = self.occupancy[0] | self.occupancy[1]
+        self.zobrist_key = zobrist_key
+        self.psqt = psqt
+        self.phase = phase
+
+        self.white_to_move = len(fields) < 2 or fields[1] != "b"
+        # Rights the FEN gives for a king or rook that is not on its starting square are dropped, castling would move a missing rook
+        self.can_castle = castling_rights_on_board(bitboards, parse_castling(fields[2]) if len(fields) > 2 else ALL_CASTLING_RIGHTS)
+
+        # The en passant square is only kept if a pawn can capture on it, like make_move does
+        self.en_passant = None
+        if len(fields) > 3 and fields[3] != "-":
+            en_passant = parse_square(fields[3])
+            if PAWN_ATTACKS[1 if self.white_to_move else 0][en_passant] & self.bitboards[W_PAWN if self.white_to_move else B_PAWN]:
+                self.en_passant = en_passant
+                self.zobrist_key ^= ZOBRIST_EN_PASSANT[en_passant & 7]
+
+        # The piece keys were added with the pieces
+        self.zobrist_key ^= ZOBRIST_CASTLING[self.can_castle]
+        if not self.white_to_move:
+            self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+
+        # EPD lines have operations instead of the move clocks
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.key_history = array("Q")
+        self.undo_stack = []
+        self.attack_maps = [None, None]
+        self.white_promote = False
+        self.black_promote = False
+        self.find_king_squares()
 
-        for symbol in fen_board:
 
-            if symbol == '/':
-                file = 0
-                rank += 1
-            else:
-                if symbol.isnumeric():
-                    file += int(symbol)
-                else:
-                    # Add pieces to 2D array representation of the board
-                    self.board[rank][file] = symbol
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        New game state set up from a FEN
+        """
+        game_state = cls(fen)
+        game_state.place_pieces_from_fen()
+        return game_state
+
+
+    @classmethod
+    def from_epd(cls, epd):
+        """
+        New game state set up from an EPD line, returns (game state, operations)
+        operations maps every opcode to its list of operands, e.g. {"bm": ["Qxf7#"], "id": ["scholar"]}
+        The hmvc and fmvn operations set the move clocks
+        """
+        fields = epd.split(None, 4)
+        if len(fields) < 4:
+            raise ValueError("an EPD needs 4 position fields: " + epd)
 
-                    file += 1
+        operations = parse_epd_operations(fields[4]) if len(fields) > 4 else {}
+        game_state = cls.from_fen(" ".join(fields[:4]))
+        if operations.get("hmvc"):
+            game_state.halfmove_clock = int(operations["hmvc"][0])
+        if operations.get("fmvn"):
+            game_state.fullmove_number = int(operations["fmvn"][0])
+        game_state.starting_pos = game_state.board_to_fen()
+
+        return game_state, operations
+
+
+    def copy(self):
+        """
+        Independent copy of the position, for analysis that keeps many positions
+        The undo records are not copied, and the key history only keeps the positions since the last capture or
+        pawn move (the only ones repetition_count looks at)
+        """
+        game_state = GameState.__new__(GameState)
+        game_state.bitboards = self.bitboards[:]
+        game_state.occupancy = self.occupancy[:]
+        game_state.occupied = self.occupied
+        game_state.squares = self.squares[:]
+        game_state.white_to_move = self.white_to_move
+        game_state.en_passant = self.en_passant
+        game_state.can_castle = self.can_castle
+        game_state.starting_pos = self.starting_pos
+        game_state.white_promote = self.white_promote
+        game_state.black_promote = self.black_promote
+        game_state.zobrist_key = self.zobrist_key
+        game_state.key_history = self.key_history[max(len(self.key_history) - self.halfmove_clock, 0):]
+        game_state.halfmove_clock = self.halfmove_clock
+        game_state.fullmove_number = self.fullmove_number
+        game_state.psqt = self.psqt
+        game_state.phase = self.phase
+        game_state.king_squares = self.king_squares[:]
+        game_state.attack_maps = self.attack_maps[:]
+        game_state.undo_stack = []
+        return game_state
+
+
+    def __getstate__(self):
+        # Pickles as the 64 square bytes and the state fields, everything else is rebuilt from them (see copy for the history)
+        history = self.key_history[max(len(self.key_history) - self.halfmove_clock, 0):]
+        return (bytes(self.squares), self.white_to_move, self.can_castle, self.en_passant, self.halfmove_clock,
+                self.fullmove_number, history.tobytes(), self.starting_pos)
+
+
+    def __setstate__(self, state):
+        squares, self.white_to_move, self.can_castle, self.en_passant, self.halfmove_clock, self.fullmove_number, history, \
+            self.starting_pos = state
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.occupied = 0
+        self.squares = bytearray([EMPTY]) * 64
+        self.zobrist_key = 0
+        self.psqt = 0
+        self.phase = 0
+        for square, piece in enumerate(squares):
+            if piece != EMPTY:
+                self.add_piece(square, piece)
+
+        self.key_history = array("Q")
+        self.key_history.frombytes(history)
+        self.zobrist_key = self.compute_zobrist_key()
+        self.white_promote = False
+        self.black_promote = False
+        self.attack_maps = [None, None]
+        self.undo_stack = []
+        self.find_king_squares()
+
+
+    def add_piece(self, square, piece):
+        bit = 1 << square
+        self.bitboards[piece] |= bit
+        self.occupancy[piece & 1] |= bit
+        self.occupied |= bit
+        self.squares[square] = piece
+        self.zobrist_key ^= ZOBRIST_PIECES[piece][square]
+        self.psqt += PIECE_SQUARE[piece][square]
+        self.phase += PHASE_WEIGHTS[piece]
+
+
+    def remove_piece(self, square):
+        piece = self.squares[square]
+        bit = 1 << square
+        self.bitboards[piece] ^= bit
+        self.occupancy[piece & 1] ^= bit
+        self.occupied ^= bit
+        self.squares[square] = EMPTY
+        self.zobrist_key ^= ZOBRIST_PIECES[piece][square]
+        self.psqt -= PIECE_SQUARE[piece][square]
+        self.phase -= PHASE_WEIGHTS[piece]
+        return piece
+
+
+    def set_piece(self, pos, symbol):
+        """
+        Puts the piece with the given symbol on pos (rank, file), None clears the square
+        """
+        square = pos[0] * 8 + pos[1]
+        if self.squares[square] != EMPTY:
+            self.remove_piece(square)
+        if symbol is not None:
+            self.add_piece(square, PIECE_FROM_SYMBOL[symbol])
+        can_castle = castling_rights_on_board(self.bitboards, self.can_castle)
+        self.zobrist_key ^= ZOBRIST_CASTLING[self.can_castle] ^ ZOBRIST_CASTLING[can_castle]
+        self.can_castle = can_castle
+        self.attack_maps = [None, None]
+        self.find_king_squares()
+
+
+    def find_king_squares(self):
+        # Sets king_squares from the bitboards, make_move and unmake_move keep them up to date after that
+        self.king_squares = [self.bitboards[W_KING].bit_length() - 1, self.bitboards[B_KING].bit_length() - 1]
 
 
     def piece_matches_turn(self, rank, file):
@@ -101,512 +696,813 @@ class GameState():
         """
 
         # If both pieces are white or both pieces are not white (black) return true
-        return self.white_to_move == self.board[rank][file].isupper()
+        return self.white_to_move == (self.squares[rank * 8 + file] & 1 == 0)
+
+
+    def find_move(self, old_pos, new_pos, promotion=QUEEN):
+        """
+        Returns the encoded legal move from old_pos to new_pos (rank, file), or None if that move is illegal
+        Pawns reaching the last rank promote to the given piece type
+        """
+        move = old_pos[0] * 8 + old_pos[1] | (new_pos[0] * 8 + new_pos[1]) << 6
+        for legal_move in self.legal_moves():
+            # The lowest 12 bits of a move are its from and to squares
+            if legal_move & 4095 == move:
+                legal_promotion = legal_move >> MOVE_PROMOTION_SHIFT & 7
+                if legal_promotion == 0 or legal_promotion == promotion:
+                    return legal_move
+
+        return None
+
+
+    @profiled("board.make_move")
+    def make_move(self, move, new_pos=None):
+        """
+        Plays a move and pushes an undo record so unmake_move can take it back
+        move is an encoded move from legal_moves(), or the (rank, file) of the piece to move when new_pos is given.
+        In that case the move is looked up in the legal moves and ignored if it is illegal
+        """
+        if new_pos is not None:
+            move = self.find_move(move, new_pos)
 
+            # Illegal moves are ignored and the same player has to move again
+            if move is None:
+                return
 
-    def make_move(self, old_pos, new_pos):
         # Unpack the piece's old and new position
-        old_rank, old_file = old_pos
-        new_rank, new_file = new_pos
-
-        # Symbol representing the piece that is moving
-        old_square = self.board[old_rank][old_file]
-        # Symbol representing the square that is being moved to
-        new_square = self.board[new_rank][new_file]
-        
-
-        # Check if move is en passant or a promotion
-        if self.board[old_rank][old_file] == "P" or self.board[old_rank][old_file] == "p":
-
-            # If new position is empty and the file pawn is in is different, move is an en passant
-            if self.board[new_rank][new_file] == None and new_file != old_file:
-                self.board[old_rank][new_file] = None
-
-            # Check for promotion
-            elif new_rank == 0:
-                self.board[old_rank][old_file] = None
-                self.white_promote = True # Used in ChessMain to update the display and give selection
-            elif new_rank == 7:
-                self.board[old_rank][old_file] = None
-                self.black_promote = True # Used in ChessMain to update the display and give selection
-        
-        # Check if move is castling
-        elif self.board[old_rank][old_file] == "K":
-
-            if "K" in self.can_castle:
-                # updates the rooks position
-                self.castling_move(old_rank, old_file, new_file)
-                self.can_castle = self.can_castle.replace("KQ", "")
-
-            elif "Q" in self.can_castle:
-                # updates the rooks position
-                self.castling_move(old_rank, old_file, new_file)
-                self.can_castle = self.can_castle.replace("KQ", "")
-
-        elif self.board[old_rank][old_file] == "k":
-            # Checks if black king can kingside castle
-            if "k" in self.can_castle:
-                # updates the rooks position
-                self.castling_move(old_rank, old_file, new_file)
-                self.can_castle = self.can_castle.replace("kq", "")
-            elif "q" in self.can_castle:
-                # updates the rooks position
-                self.castling_move(old_rank, old_file, new_file)
-                self.can_castle = self.can_castle.replace("kq", "")
-       
-        # Checks if rook moved (cannot castle on that side)
-        if (self.white_to_move and ("K" in self.can_castle or "Q" in self.can_castle)) or (not self.white_to_move and ("k" in self.can_castle or "q" in self.can_castle)):
-            if self.board[old_rank][old_file] == "R" or self.board[old_rank][old_file] == "r":
-                if old_pos == (0, 0):
-                    self.can_castle = self.can_castle.replace("q", '')
-                elif old_pos == (0, 7):
-                    self.can_castle = self.can_castle.replace("k", '')
-                elif old_pos == (7, 0):
-                    self.can_castle = self.can_castle.replace("Q", '')  
-                elif old_pos == (7, 7):
-                    self.can_castle = self.can_castle.replace("K", '')
-        
+        old_square = move & 63
+        new_square = move >> 6 & 63
+        from_bit = 1 << old_square
+        to_bit = 1 << new_square
+
+        # Piece that is moving and the piece being captured (EMPTY if the square is empty)
+        squares = self.squares
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        piece = squares[old_square]
+        captured = squares[new_square]
+        color = piece & 1
+        can_castle = self.can_castle
+        en_passant = self.en_passant
+        zobrist_key = self.zobrist_key
+        self.white_promote = False
+        self.black_promote = False
+        self.key_history.append(zobrist_key)
+
         # Makes the given move
-        self.board[new_rank][new_file] = self.board[old_rank][old_file]
-        self.board[old_rank][old_file] = None
-
-        # If player's king is in check after that player moved, undo the move and ask for a new move
-        if self.king_in_check(self.white_to_move):
-            self.board[old_rank][old_file] = old_square
-            self.board[old_rank][old_file] = self.board[new_rank][new_file]
-            self.board[new_rank][new_file] = new_square
-            return
-        
-        # Add position to the positions dictionary
-        fen_pos = self.board_to_fen()
-        if fen_pos not in self.positions:
-            self.positions[self.board_to_fen()] = 1
+        self.zobrist_key ^= ZOBRIST_PIECES[piece][old_square] ^ ZOBRIST_PIECES[piece][new_square] ^ ZOBRIST_BLACK_TO_MOVE
+        self.psqt += PIECE_SQUARE[piece][new_square] - PIECE_SQUARE[piece][old_square]
+        if captured != EMPTY:
+            self.zobrist_key ^= ZOBRIST_PIECES[captured][new_square]
+            self.psqt -= PIECE_SQUARE[captured][new_square]
+            self.phase -= PHASE_WEIGHTS[captured]
+            bitboards[captured] ^= to_bit
+            occupancy[color ^ 1] ^= to_bit
+            self.occupied ^= from_bit
         else:
-            self.positions[self.board_to_fen()] += 1
+            self.occupied ^= from_bit | to_bit
+        bitboards[piece] ^= from_bit | to_bit
+        occupancy[color] ^= from_bit | to_bit
+        squares[old_square] = EMPTY
+        squares[new_square] = piece
+        if piece >= W_KING:
+            self.king_squares[color] = new_square
+
+        # Moves with flags or a promotion need extra work
+        if move >> MOVE_PROMOTION_SHIFT:
+
+            # The pawn captured en passant is beside the moving pawn
+            if move & FLAG_EN_PASSANT:
+                captured = self.remove_piece(new_square + 8 if color == 0 else new_square - 8)
+
+            # Check if move is castling, updates the rooks position
+            elif move & FLAG_CASTLE:
+                self.castling_move(old_square >> 3, old_square & 7, new_square & 7)
+
+            # Pawns reaching the last rank are promoted, ChessMain lets the player pick another piece
+            promotion = move >> MOVE_PROMOTION_SHIFT & 7
+            if promotion:
+                self.remove_piece(new_square)
+                self.add_piece(new_square, promotion * 2 + color)
+                if color == 0:
+                    self.white_promote = True # Used in ChessMain to update the display and give selection
+                else:
+                    self.black_promote = True # Used in ChessMain to update the display and give selection
+
+        # Moving the king or a rook, or capturing a rook on its starting square removes castling on that side
+        if can_castle:
+            self.can_castle = can_castle & CASTLING_RIGHTS_KEPT[old_square] & CASTLING_RIGHTS_KEPT[new_square]
+            if self.can_castle != can_castle:
+                self.zobrist_key ^= ZOBRIST_CASTLING[can_castle] ^ ZOBRIST_CASTLING[self.can_castle]
+
+        # A pawn that moved 2 squares next to an enemy pawn can be captured en passant on the square it skipped
+        if en_passant is not None:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[en_passant & 7]
+        self.en_passant = None
+        if move & FLAG_DOUBLE_PUSH:
+            skipped = (old_square + new_square) >> 1
+            if PAWN_ATTACKS[color][skipped] & bitboards[B_PAWN - color]:
+                self.en_passant = skipped
+                self.zobrist_key ^= ZOBRIST_EN_PASSANT[skipped & 7]
+
+        # Captures and pawn moves cannot be undone, so positions before them can never be repeated
+        if captured != EMPTY or piece == W_PAWN or piece == B_PAWN:
+            halfmove_clock = self.halfmove_clock
+            self.halfmove_clock = 0
+        else:
+            halfmove_clock = self.halfmove_clock
+            self.halfmove_clock += 1
+
+        # The attack map of the side that moved is recomputed when it is needed. The other side's map stays valid unless
+        # one of its pieces was captured or it attacked the from or to square (only then can one of its slider lines change)
+        attack_maps = self.attack_maps
+        other_attacks = attack_maps[color ^ 1]
+        if other_attacks is not None and (captured != EMPTY or move & (FLAG_EN_PASSANT | FLAG_CASTLE) or other_attacks & (from_bit | to_bit)):
+            other_attacks = None
+        self.attack_maps = [None, other_attacks] if color == 0 else [other_attacks, None]
+
+        self.undo_stack.append((move, piece, captured, can_castle, en_passant, halfmove_clock, zobrist_key, attack_maps))
 
         # Toggle the turn
         self.white_to_move = not self.white_to_move
-    
+        if color == 1:
+            self.fullmove_number += 1
 
-    def castling_move(self, old_rank, old_file, new_file):
-        # If king castled king side
-        if old_file - new_file == -2:
-            self.board[old_rank][old_file + 1] = self.board[old_rank][7]
-            self.board[old_rank][7] = None
-        # If king castled queen side
-        if old_file - new_file == 2:
-            self.board[old_rank][old_file - 1] = self.board[old_rank][0]
-            self.board[old_rank][0] = None
 
-    
-    def generate_moves(self, piece_pos, danger=False):
+    @profiled("board.unmake_move")
+    def unmake_move(self):
         """
-        Generates the moves for a given piece
-        if danger is True, the function is being called to check for squares under attack, so forward pawn moves should be excluded
+        Takes back the last move played with make_move using its undo record
         """
-        rank, file = piece_pos
-        piece_type = self.board[rank][file]
+        move, piece, captured, can_castle, en_passant, halfmove_clock, zobrist_key, attack_maps = self.undo_stack.pop()
+        old_square = move & 63
+        new_square = move >> 6 & 63
 
-        if piece_type == "p" or piece_type == "P":
-            moves = self.generate_pawn_moves(piece_pos, piece_type, danger)
-
-        elif piece_type == "r" or piece_type == "R":
-            moves = self.generate_rook_moves(piece_pos, piece_type)
-
-        elif piece_type == "n" or piece_type == "N":
-            moves = self.generate_knight_moves(piece_pos, piece_type)
-
-        elif piece_type == "b" or piece_type == "B":
-            moves = self.generate_bishop_moves(piece_pos, piece_type)
+        self.white_to_move = not self.white_to_move
+        if not self.white_to_move:
+            self.fullmove_number -= 1
+        self.key_history.pop()
+
+        # Whatever stands on the new square (a promoted piece included) is replaced by the piece that moved
+        self.remove_piece(new_square)
+        self.add_piece(old_square, piece)
+        if piece >= W_KING:
+            self.king_squares[piece & 1] = old_square
+
+        if move & FLAG_EN_PASSANT:
+            self.add_piece(new_square + 8 if piece == W_PAWN else new_square - 8, captured)
+        elif captured != EMPTY:
+            self.add_piece(new_square, captured)
+        elif move & FLAG_CASTLE:
+            # Move the rook back to its corner
+            if new_square > old_square:
+                self.add_piece(old_square + 3, self.remove_piece(old_square + 1))
+            else:
+                self.add_piece(old_square - 4, self.remove_piece(old_square - 1))
+
+        self.can_castle = can_castle
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.zobrist_key = zobrist_key
+        self.attack_maps = attack_maps
+        self.white_promote = False
+        self.black_promote = False
 
-        elif piece_type == "q" or piece_type == "Q":
-            moves = self.generate_queen_moves(piece_pos, piece_type)
 
-        elif piece_type == "k" or piece_type == "K":
-            moves = self.generate_king_moves(piece_pos, piece_type)
+    def castling_move(self, old_rank, old_file, new_file):
+        # If king castled king side
+        if old_file - new_file == -2:
+            rook_from, rook_to = old_rank * 8 + 7, old_rank * 8 + old_file + 1
+        # If king castled queen side
+        else:
+            rook_from, rook_to = old_rank * 8, old_rank * 8 + old_file - 1
 
-        return moves
-    
-
-    def generate_pawn_moves(self, piece_pos, piece_type, danger=False):
-        """ Pawn's Moves:
-        1 square forward if it is empty and 2 squares forward if the 2 squares infront are empty and it is the pawns first move
-        Pawns can capture on diagonals and canpture with en passant (diagonally if the enemy pawn moved 2 squares in the last move)
-        If danger is True, the function is being called to check for squares under attack, so forward pawn moves should be excluded
-        """
-        rank, file = piece_pos
-        moves = [] # Store the piece's possible moves
-        last_move = self.last_move # stored as [(x,y), piece_type, (x,y)]
-
-        # White moves -1 squares, black moves 1 square
-        i = -1 if self.white_to_move else 1
-
-        # If danger is false, normal pawn moves are calculated
-        # Pawn can move 1 square forward if it is empty and inbounds
-        if not danger:
-            if 7 >= rank + i >= 0:
-                if self.board[rank + i][file] == None:
-                    moves.append((rank + i, file))
-
-        # Pawn can move 2 squares forward if it hasn't moved and 2 squares infront are empty
-        if not danger:
-            if (self.white_to_move and rank == 6) or (not self.white_to_move and rank == 1):
-                if self.board[rank + i][file] == None and self.board[rank + i * 2][file] == None:
-                    moves.append((rank + i * 2, file))
-
-        # Pawn can take on diagonals if it is inbounds
-        for j in [-1, 1]:
-            if 7 >= rank + i >= 0 and 7 >= file + j >= 0:
-                if self.board[rank + i][file + j] is not None and not self.piece_matches_turn(rank + i, file + j):
-                    moves.append((rank + i, file + j))
-
-        # Can en-passant if: 
-        # last move was made by a pawn
-        if last_move is not None:
-            if last_move[1] in 'Pp':
-                old_rank, old_file = last_move[0]
-                new_rank, new_file = last_move[2]
-
-                # If the pawn moved 2 square
-                if (old_rank - new_rank) ** 2 == 4:
-
-                    # If the pawn moving is on the right of that pawn
-                    if file + 1 <= 7:
-                        if self.board[rank][file + 1] == self.board[new_rank][new_file]:
-                            moves.append((rank + i, new_file))
-
-                    # If the pawn moving is on the left of that pawn
-                    if file - 1 >= 0:
-                        if self.board[rank][file - 1] == self.board[new_rank][new_file]:
-                            moves.append((rank + i, new_file))
+        self.add_piece(rook_to, self.remove_piece(rook_from))
+        return rook_from, rook_to
 
-        return moves
-    
 
-    def generate_rook_moves(self, piece_pos, piece_type):
-        
-        """ Rook's Moves:
-        Check column/row until an obstruction is encountered.
-        If the obstruction is an opponent's piece, include it as a valid move (capture).
+    @profiled("movegen.legal_moves")
+    def legal_moves(self, kind=MOVES_ALL, from_mask=FULL_BOARD):
+        """
+        Generates every legal move of the side to move as encoded moves
+        Checkers and pinned pieces are found once for the position, then every piece is only given targets that keep
+        the king safe: capturing or blocking a single checker, staying on its pin line, and the king only moving to
+        squares the enemy does not attack
+        kind limits the moves to MOVES_NOISY or MOVES_QUIET so a search can generate them in stages,
+        from_mask limits them to the pieces on those squares
         """
         moves = []
-        possible_moves = [(-1, 0), (1, 0), (0, -1), (0, 1)] # Possible standard rook moves
-        # Rook is white if variable is true, else black
-        white = True if piece_type.isupper() else False
-
-        # For each standard move, increment by the move until an enemy, ally, or boundry is reached
-        # Add the move to the moves list (including capture if piece is an enemy) then reset the peice's position
-        for i, j in possible_moves:
-            rank, file = piece_pos
-            while True:
-                rank += i
-                file += j
-                if 0 <= rank < 8 and 0 <= file < 8:
-
-                    # If a piece is in the way
-                    if self.board[rank][file] is not None:
-                        
-                        # Add move if piece is an enemy piece
-                        if not self.piece_matches_turn(rank, file):
-                            moves.append((rank, file))
-                        # Enemy/ally piece is reached
-                        break
-
-                    # If no piece is in the way append move
-                    else:
-                        moves.append((rank, file))
+        append = moves.append
+        bitboards = self.bitboards
+        occupied = self.occupied
+        empty = FULL_BOARD ^ occupied
 
-                # Edge of the board is reached
+        if self.white_to_move:
+            color, enemy_color = 0, 1
+        else:
+            color, enemy_color = 1, 0
+        own = self.occupancy[color]
+        enemy = self.occupancy[enemy_color]
+        noisy = kind != MOVES_QUIET
+        quiet = kind != MOVES_NOISY
+
+        # Squares pieces can move to for the kind of moves asked for
+        if kind == MOVES_ALL:
+            destinations = FULL_BOARD ^ own
+        elif kind == MOVES_NOISY:
+            destinations = enemy
+        else:
+            destinations = empty
+
+        king = bitboards[W_KING + color]
+        king_square = self.king_squares[color]
+        enemy_queens = bitboards[W_QUEEN + enemy_color]
+        enemy_rooks = bitboards[W_ROOK + enemy_color] | enemy_queens
+        enemy_bishops = bitboards[W_BISHOP + enemy_color] | enemy_queens
+
+        # Enemy pieces giving check
+        checkers = (PAWN_ATTACKS[color][king_square] & bitboards[W_PAWN + enemy_color]) \
+            | (KNIGHT_ATTACKS[king_square] & bitboards[W_KNIGHT + enemy_color]) \
+            | (ROOK_TABLE[king_square][occupied & ROOK_MASKS[king_square]] & enemy_rooks) \
+            | (BISHOP_TABLE[king_square][occupied & BISHOP_MASKS[king_square]] & enemy_bishops)
+
+        if king & from_mask:
+            danger_squares = self.attacked_squares(enemy_color == 0)
+
+            # The king cannot step back along the line of a slider that is checking it
+            sliders = checkers & (enemy_rooks | enemy_bishops)
+            while sliders:
+                bit = sliders & -sliders
+                square = bit.bit_length() - 1
+                if bit & ROOK_TABLE[king_square][0]:
+                    danger_squares |= ROOK_TABLE[square][(occupied ^ king) & ROOK_MASKS[square]]
                 else:
-                    break
-
-        return moves        
-    
-    def generate_knight_moves(self, piece_pos, piece_type):
-        """ 
-        Knight can move and take in an L shape and can jump over pieces
-        """
-        moves = []
-        # Possible standard horse moves
-        possible_moves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
-
-        # Loop through possible moves
-        # If destination is empty or an enemy piece, add move
-        for i, j in possible_moves:
-            rank, file = piece_pos
-            rank += i
-            file += j
-            if 0 <= rank < 8 and 0 <= file < 8:
-                # If square is empty, append move
-                if self.board[rank][file] is None:
-                    moves.append((rank, file))
-                # If enemy on square, append move
-                elif not self.piece_matches_turn(rank, file):
-                    moves.append((rank, file))
+                    danger_squares |= BISHOP_TABLE[square][(occupied ^ king) & BISHOP_MASKS[square]]
+                sliders ^= bit
+
+            targets = KING_ATTACKS[king_square] & destinations & ~danger_squares
+            while targets:
+                target = targets & -targets
+                append(king_square | (target.bit_length() - 1) << 6)
+                targets ^= target
+
+            # Castling, the squares between king and rook must be empty and the king cannot pass through an attacked square
+            if quiet and self.can_castle and not checkers:
+                back_rank = 56 if color == 0 else 0
+                kingside, queenside = (CASTLE_WHITE_KINGSIDE, CASTLE_WHITE_QUEENSIDE) if color == 0 else (CASTLE_BLACK_KINGSIDE, CASTLE_BLACK_QUEENSIDE)
+                if self.can_castle & kingside and not (occupied | danger_squares) & (3 << (back_rank + 5)):
+                    append(king_square | (king_square + 2) << 6 | FLAG_CASTLE)
+                if self.can_castle & queenside and not occupied & (7 << (back_rank + 1)) and not danger_squares & (3 << (back_rank + 2)):
+                    append(king_square | (king_square - 2) << 6 | FLAG_CASTLE)
+
+        # In double check only the king can move
+        if checkers & (checkers - 1):
+            return moves
+
+        # A single check has to be blocked or the checking piece captured
+        target_mask = BETWEEN[king_square][checkers.bit_length() - 1] | checkers if checkers else FULL_BOARD
+
+        # Pinned pieces are our pieces that are the only piece between the king and an enemy slider
+        # they can only move along the line between the two (capturing the slider included)
+        pinned = 0
+        pin_lines = {}
+        snipers = (ROOK_TABLE[king_square][0] & enemy_rooks) | (BISHOP_TABLE[king_square][0] & enemy_bishops)
+        while snipers:
+            bit = snipers & -snipers
+            line = BETWEEN[king_square][bit.bit_length() - 1]
+            blockers = line & occupied
+            if blockers & own and not blockers & (blockers - 1):
+                pinned |= blockers
+                pin_lines[blockers] = line | bit
+            snipers ^= bit
+
+        # Pawn moves of pawns that are not pinned are generated for all pawns at once, from square = to square + offset
+        # Pushes to the last rank are promotions, so they count as noisy moves
+        pawns = bitboards[W_PAWN + color] & from_mask
+        free_pawns = pawns & ~pinned
+        if color == 0:
+            single_pushes = (free_pawns >> 8) & empty
+            double_pushes = ((single_pushes & RANK_3) >> 8) & empty & target_mask
+            left_captures = (free_pawns >> 9) & NOT_FILE_H & enemy & target_mask
+            right_captures = (free_pawns >> 7) & NOT_FILE_A & enemy & target_mask
+            push, left, right = 8, 9, 7
+        else:
+            single_pushes = (free_pawns << 8) & empty
+            double_pushes = ((single_pushes & RANK_6) << 8) & empty & target_mask
+            left_captures = (free_pawns << 7) & NOT_FILE_H & enemy & target_mask
+            right_captures = (free_pawns << 9) & NOT_FILE_A & enemy & target_mask
+            push, left, right = -8, -7, -9
+        single_pushes &= target_mask
+
+        if not noisy:
+            single_pushes &= ~PROMOTION_RANKS
+            left_captures = right_captures = 0
+        if not quiet:
+            single_pushes &= PROMOTION_RANKS
+            double_pushes = 0
+
+        for targets, offset in ((single_pushes, push), (left_captures, left), (right_captures, right)):
+            promotions = targets & PROMOTION_RANKS
+            targets ^= promotions
+            while targets:
+                bit = targets & -targets
+                to = bit.bit_length() - 1
+                append(to + offset | to << 6)
+                targets ^= bit
+            while promotions:
+                bit = promotions & -promotions
+                to = bit.bit_length() - 1
+                move = to + offset | to << 6
+                for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                    append(move | promotion << MOVE_PROMOTION_SHIFT)
+                promotions ^= bit
+
+        while double_pushes:
+            bit = double_pushes & -double_pushes
+            to = bit.bit_length() - 1
+            append(to + 2 * push | to << 6 | FLAG_DOUBLE_PUSH)
+            double_pushes ^= bit
+
+        # Pinned pawns are handled one at a time
+        pinned_pawns = pawns & pinned
+        while pinned_pawns:
+            bit = pinned_pawns & -pinned_pawns
+            square = bit.bit_length() - 1
+            allowed = pin_lines[bit] & target_mask
+            targets = PAWN_ATTACKS[color][square] & enemy & allowed if noisy else 0
+            forward = square - push
+            if empty >> forward & 1:
+                targets |= (1 << forward) & allowed & (PROMOTION_RANKS if not quiet else FULL_BOARD if noisy else ~PROMOTION_RANKS)
+                if quiet and bit & (RANK_2 if color == 0 else RANK_7) and empty >> (forward - push) & 1:
+                    targets |= (1 << (forward - push)) & allowed
+            while targets:
+                target = targets & -targets
+                to = target.bit_length() - 1
+                if target & PROMOTION_RANKS:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        append(square | to << 6 | promotion << MOVE_PROMOTION_SHIFT)
+                elif (to - square) ** 2 == 256:
+                    append(square | to << 6 | FLAG_DOUBLE_PUSH)
+                else:
+                    append(square | to << 6)
+                targets ^= target
+            pinned_pawns ^= bit
+
+        # En passant is checked by playing it on the occupancy, this also covers the pawns leaving the king's rank together
+        en_passant = self.en_passant
+        if en_passant is not None and noisy:
+            en_passant_bit = 1 << en_passant
+            captured_bit = 1 << (en_passant + push)
+            if target_mask & (en_passant_bit | captured_bit):
+                attackers = PAWN_ATTACKS[enemy_color][en_passant] & pawns
+                while attackers:
+                    bit = attackers & -attackers
+                    after = (occupied ^ bit ^ captured_bit) | en_passant_bit
+                    if not (ROOK_TABLE[king_square][after & ROOK_MASKS[king_square]] & enemy_rooks
+                            or BISHOP_TABLE[king_square][after & BISHOP_MASKS[king_square]] & enemy_bishops):
+                        append(bit.bit_length() - 1 | en_passant << 6 | FLAG_EN_PASSANT)
+                    attackers ^= bit
+
+        # Knights, bishops, rooks and queens look up their attacks from the tables, a pinned knight can never move
+        destinations &= target_mask
+        knights = bitboards[W_KNIGHT + color] & ~pinned & from_mask
+        while knights:
+            bit = knights & -knights
+            square = bit.bit_length() - 1
+            targets = KNIGHT_ATTACKS[square] & destinations
+            while targets:
+                target = targets & -targets
+                append(square | (target.bit_length() - 1) << 6)
+                targets ^= target
+            knights ^= bit
+
+        queens = bitboards[W_QUEEN + color]
+        bishops = (bitboards[W_BISHOP + color] | queens) & from_mask
+        while bishops:
+            bit = bishops & -bishops
+            square = bit.bit_length() - 1
+            targets = BISHOP_TABLE[square][occupied & BISHOP_MASKS[square]] & destinations
+            if bit & pinned:
+                targets &= pin_lines[bit]
+            while targets:
+                target = targets & -targets
+                append(square | (target.bit_length() - 1) << 6)
+                targets ^= target
+            bishops ^= bit
+
+        # Queens are generated as both a bishop and a rook
+        rooks = (bitboards[W_ROOK + color] | queens) & from_mask
+        while rooks:
+            bit = rooks & -rooks
+            square = bit.bit_length() - 1
+            targets = ROOK_TABLE[square][occupied & ROOK_MASKS[square]] & destinations
+            if bit & pinned:
+                targets &= pin_lines[bit]
+            while targets:
+                target = targets & -targets
+                append(square | (target.bit_length() - 1) << 6)
+                targets ^= target
+            rooks ^= bit
 
         return moves
-    
-    def generate_bishop_moves(self, piece_pos, piece_type):
-        """Bishop's Moves:
-        Check diagonal positions until an obstruction is encountered.
-        If the obstruction is an opponent's piece, include it as a valid move (capture).
-        """
 
-        moves = []
-        # Possible standard bishop moves
-        possible_moves = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-
-        # For each standard move, increment by the move until an enemy, ally, or boundry is reached
-        # Add the move to the moves list (including capture if piece is an enemy) then reset the peice's position
-        for i, j in possible_moves:
-            rank, file = piece_pos
-            while True:
-                rank += i
-                file += j
-                if 0 <= rank < 8 and 0 <= file < 8:
-                    if self.board[rank][file] is not None:
-
-                        # Add move if piece is opposite color
-                        if not self.piece_matches_turn(rank, file):
-                            moves.append((rank, file))
-                        # Enemy/ally piece is reached
-                        break
-
-                    # If no piece is in the way append move        
-                    else:
-                        moves.append((rank, file))
 
-                # Edge of the board is reached
-                else:
-                    break
-
-        return moves
-    
-    
-    def generate_queen_moves(self, piece_pos, piece_type):
-        """ 
-        Calculates and returns all possible moves for a queen on the chessboard.
-        ueens can move in any direction (horizontally, vertically, or diagonally) until they
-        encounter an obstacle (another piece or the edge of the board)
+    def is_legal(self, move):
         """
-        moves = []
+        Returns True if the encoded move is legal in the position
+        Used for moves that come from somewhere else (the transposition table, killer moves) before they are played
+        """
+        piece = self.squares[move & 63]
+        if piece == EMPTY or (piece & 1 == 0) != self.white_to_move:
+            return False
 
-        # Possible standard queen moves
-        possible_moves = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-
-        # For each standard move, increment by the move until an enemy, ally, or boundry is reached
-        # Add the move to the moves list (including capture if piece is an enemy) then reset the peice's position
-        for i, j in possible_moves:
-            rank, file = piece_pos
-            while True:
-                rank += i
-                file += j
-                if 0 <= rank < 8 and 0 <= file < 8:
-                    if self.board[rank][file] is not None:
-
-                        # Add move if piece is opposite color
-                        if not self.piece_matches_turn(rank, file):
-                            moves.append((rank, file))
-                        # Enemy/ally piece is reached
-                        break
-                    
-                    # Square is empty
-                    else:
-                        moves.append((rank, file))
+        return move in self.legal_moves(MOVES_ALL, 1 << (move & 63))
 
-                # Boundry is reached
-                else:
-                    break
 
-        return moves
-    
-    def generate_king_moves(self, piece_pos, piece_type):
-        """ 
-        King can move 1 square in any direction if they are not under attack
-        King can castle (move 2 square either direction and the rook jumps to the opposite side of the king)
-        """
-        moves = []
+    def is_capture(self, move):
+        # Captures, en passant included
+        return self.squares[move >> 6 & 63] != EMPTY or move & FLAG_EN_PASSANT != 0
 
-        # Possible standard queen moves
-        possible_moves = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
 
-        tic = time.perf_counter()
-        danger_squares = self.find_danger_squares(self.white_to_move, piece_pos)
-        toc = time.perf_counter()
-        print(f"Found danger squares in {toc - tic:0.6f} seconds")
+    @profiled("movegen.generate_moves")
+    def generate_moves(self, piece_pos):
+        """
+        Generates the legal moves for a given piece as a list of the (rank, file) squares it can move to
+        """
+        square = piece_pos[0] * 8 + piece_pos[1]
+        # The targets are gathered in a bitboard, so the 4 promotions to the same square are a single destination
+        targets = 0
+        for move in self.cached_legal_moves():
+            if move & 63 == square:
+                targets |= 1 << (move >> 6 & 63)
 
-        # Make each standard move and append it if square is an enemy or empty
-        for i, j in possible_moves:
-            rank, file = piece_pos
-            rank += i
-            file += j
+        return bitboard_to_squares(targets)
 
-            if 0 <= rank < 8 and 0 <= file < 8:
-                # If square is an enemy or is empty, append move
-                if self.board[rank][file] is None or not self.piece_matches_turn(rank, file):
-                    if (rank, file) not in danger_squares:
-                        moves.append((rank, file)) 
 
-        rank, file = piece_pos
+    def cached_legal_moves(self):
+        """
+        Legal moves of the position as a tuple from the shared LegalMoveCache, for callers that ask for the same
+        position's moves again (the GUI and the game over checks), the search uses legal_moves directly
+        """
+        return LEGAL_MOVE_CACHE.moves(self)
 
-        # Check if king can king side castle
-        if (self.white_to_move and "K" in self.can_castle) or (not self.white_to_move and "k" in self.can_castle):
 
-            if self.board[rank][file + 1] == None and self.board[rank][file + 2] == None:
+    def attacked_squares(self, by_white):
+        """
+        Returns a bitboard of every square attacked by the given color
+        The map is kept for the position and carried through make_move/unmake_move, so it is only computed once
+        """
+        color = 0 if by_white else 1
+        attacks = self.attack_maps[color]
+        if attacks is None:
+            attacks = self.attack_maps[color] = self.compute_attacks(by_white)
 
-                # Cannot castle if either of the 2 squares on the right are under attack
-                if (rank, file + 2) not in danger_squares and (rank, file + 1) not in danger_squares:
-                    moves.append((rank, file + 2))
+        return attacks
 
-        # Check if king can queen side castle
-        if (self.white_to_move and "Q" in self.can_castle) or (not self.white_to_move and "q" in self.can_castle):
 
-            if self.board[rank][file - 1] == None and self.board[rank][file - 2] == None and self.board[rank][file - 3] == None:
+    @profiled("attacks.compute_attacks")
+    def compute_attacks(self, by_white):
+        """
+        Builds the attack map of the given color from the bitboards
+        """
+        occupied = self.occupied
+        bitboards = self.bitboards
+
+        # Pawn attacks are computed for all pawns at once
+        if by_white:
+            color = 0
+            pawns = bitboards[W_PAWN]
+            attacks = ((pawns >> 9) & NOT_FILE_H) | ((pawns >> 7) & NOT_FILE_A)
+        else:
+            color = 1
+            pawns = bitboards[B_PAWN]
+            attacks = ((pawns << 7) & NOT_FILE_H) | ((pawns << 9) & NOT_FILE_A)
+
+        knights = bitboards[W_KNIGHT + color]
+        while knights:
+            bit = knights & -knights
+            attacks |= KNIGHT_ATTACKS[bit.bit_length() - 1]
+            knights ^= bit
+
+        queens = bitboards[W_QUEEN + color]
+        rooks = bitboards[W_ROOK + color] | queens
+        while rooks:
+            bit = rooks & -rooks
+            square = bit.bit_length() - 1
+            attacks |= ROOK_TABLE[square][occupied & ROOK_MASKS[square]]
+            rooks ^= bit
+
+        bishops = bitboards[W_BISHOP + color] | queens
+        while bishops:
+            bit = bishops & -bishops
+            square = bit.bit_length() - 1
+            attacks |= BISHOP_TABLE[square][occupied & BISHOP_MASKS[square]]
+            bishops ^= bit
+
+        king_square = self.king_squares[color]
+        if king_square >= 0:
+            attacks |= KING_ATTACKS[king_square]
+
+        return attacks
+
+
+    def mobility(self, white):
+        """
+        Number of squares the knights, bishops, rooks and queens of a color can move to (ignoring pins and checks),
+        as [knights, bishops, rooks, queens]
+        """
+        color = 0 if white else 1
+        bitboards = self.bitboards
+        occupied = self.occupied
+        not_own = FULL_BOARD ^ self.occupancy[color]
+        counts = [0, 0, 0, 0]
+
+        knights = bitboards[W_KNIGHT + color]
+        while knights:
+            bit = knights & -knights
+            counts[0] += (KNIGHT_ATTACKS[bit.bit_length() - 1] & not_own).bit_count()
+            knights ^= bit
+
+        bishops = bitboards[W_BISHOP + color]
+        while bishops:
+            bit = bishops & -bishops
+            square = bit.bit_length() - 1
+            counts[1] += (BISHOP_TABLE[square][occupied & BISHOP_MASKS[square]] & not_own).bit_count()
+            bishops ^= bit
+
+        rooks = bitboards[W_ROOK + color]
+        while rooks:
+            bit = rooks & -rooks
+            square = bit.bit_length() - 1
+            counts[2] += (ROOK_TABLE[square][occupied & ROOK_MASKS[square]] & not_own).bit_count()
+            rooks ^= bit
+
+        queens = bitboards[W_QUEEN + color]
+        while queens:
+            bit = queens & -queens
+            square = bit.bit_length() - 1
+            counts[3] += ((ROOK_TABLE[square][occupied & ROOK_MASKS[square]] | BISHOP_TABLE[square][occupied & BISHOP_MASKS[square]]) & not_own).bit_count()
+            queens ^= bit
+
+        return counts
+
+
+    def is_attacked(self, square, by_white):
+        """
+        Returns True if the given color attacks the square
+        Uses the attack map if it is already known, otherwise looks outwards from the square with every piece's moves
+        and checks if it finds a matching enemy piece
+        """
+        color = 0 if by_white else 1
+        attacks = self.attack_maps[color]
+        if attacks is not None:
+            return attacks >> square & 1 == 1
 
-                # Check if king can kingside castle
-                if (rank, file - 2) not in danger_squares and (rank, file - 1) not in danger_squares:
-                    moves.append((rank, file - 2))
+        occupied = self.occupied
+        bitboards = self.bitboards
 
-        return moves
+        if PAWN_ATTACKS[color ^ 1][square] & bitboards[W_PAWN + color]:
+            return True
+        if KNIGHT_ATTACKS[square] & bitboards[W_KNIGHT + color]:
+            return True
+        if KING_ATTACKS[square] & bitboards[W_KING + color]:
+            return True
 
+        queens = bitboards[W_QUEEN + color]
+        if ROOK_TABLE[square][occupied & ROOK_MASKS[square]] & (bitboards[W_ROOK + color] | queens):
+            return True
+        if BISHOP_TABLE[square][occupied & BISHOP_MASKS[square]] & (bitboards[W_BISHOP + color] | queens):
+            return True
+
+        return False
 
-    def find_danger_squares(self, white, king_pos, save_king=False):
-        # Find all squares that are under attack
-        danger_squares = []
 
-        king_r, king_f = king_pos
+    def attackers_to(self, square, occupied):
+        """
+        Bitboard of the pieces of both colors that attack the square with the given occupancy
+        Pieces that are not in occupied are ignored, and sliders see through squares that are not in it
+        """
+        bitboards = self.bitboards
+        queens = bitboards[W_QUEEN] | bitboards[B_QUEEN]
+        attackers = (PAWN_ATTACKS[1][square] & bitboards[W_PAWN]) \
+            | (PAWN_ATTACKS[0][square] & bitboards[B_PAWN]) \
+            | (KNIGHT_ATTACKS[square] & (bitboards[W_KNIGHT] | bitboards[B_KNIGHT])) \
+            | (KING_ATTACKS[square] & (bitboards[W_KING] | bitboards[B_KING])) \
+            | (ROOK_TABLE[square][occupied & ROOK_MASKS[square]] & (bitboards[W_ROOK] | bitboards[B_ROOK] | queens)) \
+            | (BISHOP_TABLE[square][occupied & BISHOP_MASKS[square]] & (bitboards[W_BISHOP] | bitboards[B_BISHOP] | queens))
 
-        # Removes the king when generating moves to accurately caputure danger squares
-        king = self.board[king_r][king_f]
-        self.board[king_r][king_f] = None
+        return attackers & occupied
 
-        # Loops through every square in the board
-        for r, rank in enumerate(self.board):
-            for f, piece in enumerate(rank):
-                # Generate only enemy and non-king moves
-                if piece is not None:
-                    if (white and piece.islower()) or (not white and piece.isupper()):
-                        if piece != "K" and piece != "k":
 
-                            danger_moves = self.generate_moves((r,f), True)
+    def see(self, move):
+        """
+        Static exchange evaluation, the material the side to move wins (in centipawns, negative if it loses material)
+        if both sides keep capturing on the target square of the move with their least valuable piece
+        Either side can stop capturing when it would lose material, pins are ignored
+        """
+        squares = self.squares
+        bitboards = self.bitboards
+        from_square = move & 63
+        to = move >> 6 & 63
+        occupied = self.occupied ^ (1 << from_square)
+
+        piece = squares[from_square]
+        captured = squares[to]
+        if move & FLAG_EN_PASSANT:
+            gain = [SEE_VALUES[PAWN]]
+            occupied ^= 1 << (to + (8 if piece == W_PAWN else -8))
+        else:
+            gain = [SEE_VALUES[captured >> 1] if captured != EMPTY else 0]
+
+        # The piece on the square is the one the other side can capture next
+        on_square = SEE_VALUES[piece >> 1]
+        promotion = move >> MOVE_PROMOTION_SHIFT & 7
+        if promotion:
+            gain[0] += SEE_VALUES[promotion] - SEE_VALUES[PAWN]
+            on_square = SEE_VALUES[promotion]
+
+        rooks = bitboards[W_ROOK] | bitboards[B_ROOK] | bitboards[W_QUEEN] | bitboards[B_QUEEN]
+        bishops = bitboards[W_BISHOP] | bitboards[B_BISHOP] | bitboards[W_QUEEN] | bitboards[B_QUEEN]
+        attackers = self.attackers_to(to, occupied)
+        color = (piece & 1) ^ 1
+
+        while True:
+            side_attackers = attackers & self.occupancy[color]
+            if not side_attackers:
+                break
+
+            # Least valuable attacker
+            for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+                candidates = side_attackers & bitboards[piece_type * 2 + color]
+                if candidates:
+                    break
 
-                            # Add unique enemy moves to danger squares
-                            for ele in danger_moves:
-                                if ele not in danger_squares:
-                                    danger_squares.append(ele)
+            # The king can only capture if the square is not defended any more
+            if piece_type == KING and attackers & self.occupancy[color ^ 1]:
+                break
 
-        # Place the king back on the board
-        self.board[king_r][king_f] = king
+            gain.append(on_square - gain[-1])
+            on_square = SEE_VALUES[piece_type]
+            bit = candidates & -candidates
+            occupied ^= bit
 
-        # If save_king is true, return the king position to help with efficiency
-        if save_king:
-            return danger_squares, king_pos
-        
-        return danger_squares
+            # Sliders behind the piece that captured can now reach the square
+            if piece_type in (PAWN, BISHOP, QUEEN):
+                attackers |= BISHOP_TABLE[to][occupied & BISHOP_MASKS[to]] & bishops
+            if piece_type in (ROOK, QUEEN):
+                attackers |= ROOK_TABLE[to][occupied & ROOK_MASKS[to]] & rooks
+            attackers &= occupied
+            color ^= 1
 
+        # Going back through the captures, each side only captures if it does not lose material by it
+        for depth in range(len(gain) - 1, 0, -1):
+            gain[depth - 1] = -max(-gain[depth - 1], gain[depth])
 
-    def king_in_check(self, white):
-        king_pos = self.find_king(white)
+        return gain[0]
 
-        danger_squares = self.find_danger_squares(white, king_pos)
 
+    def king_in_check(self, white):
         # If king is in a square that is under attack return True
-        if king_pos in danger_squares:
-            return True
+        return self.is_attacked(self.king_squares[0 if white else 1], not white)
 
-        return False
-    
 
     def king_in_checkmate(self, white):
         """
-        For every piece that is the correct color and not the king,
-        Generate their moves, make that move in the temporary board
-        If the move takes the king out of check, it is not checkmate
-        If no moves take the king out of check, it is checkmate
+        legal_moves only returns moves that leave the king out of check,
+        so if the king is in check and there are no legal moves it is checkmate
         """
+        return self.king_in_check(white) and not self.cached_legal_moves()
 
-        # Create a temporary board and loop through pieces
-        for r, rank in enumerate(self.board):
-            for f, piece in enumerate(rank):
-                if self.board[r][f] is not None:
-                    if self.piece_matches_turn(r,f):
-                        # Generate the ally piece's moves
-                        moves = self.generate_moves((r,f))
-
-                        for move in moves:
-                            # Make a deep copy of the game state
-                            temp_game_state = cp.deepcopy(self)
-                            temp_game_state.make_move((r, f), move)
 
-                            # If the king is not in check after the move in the temp game state, it is not checkmate
-                            if not temp_game_state.king_in_check(white):
-                                return False
-
-        return True
-        
-    
     def find_king(self, white):
+        king_square = self.king_squares[0 if white else 1]
+        if king_square >= 0:
+            return divmod(king_square, 8)
 
-        # search for white king from the bottom up
-        if white:
-            for r in range(7, -1, -1):
-                for f in range(8):
-                    if self.board[r][f] == 'K':
-                        return (r, f)
-        # search for the black king form the top down
-        else:
-            for r in range(8):
-                for f in range(8):
-                    if self.board[r][f] == 'k':
-                        return (r, f)
-                                        
 
     def is_stalemate(self, white):
-        # Loop through the board
-        for r in range(8):    
-            for f, piece in enumerate(self.board[r]):
-                if piece is not None:
-                    if self.piece_matches_turn(r,f):
-                        # If any ally has moves, it is not stalemate
-                        if self.generate_moves((r, f)):
-                            return False
-
-        return True
-    
+        # If any ally has moves, it is not stalemate
+        return not self.cached_legal_moves()
+
 
     def board_to_fen(self):
+        """
+        FEN of the position: piece placement, side to move, castling rights, en passant square and move clocks
+        The en passant square is only written when a pawn can capture on it
+        """
         # Use StringIO to build string more efficiently than concatenating
         with io.StringIO() as s:
-            for row in self.board:
+            squares = self.squares
+            for rank in range(8):
                 empty = 0
-                for cell in row:
-                    if cell:
+                for square in range(rank * 8, rank * 8 + 8):
+                    piece = squares[square]
+                    if piece != EMPTY:
                         if empty > 0:
                             s.write(str(empty))
                             empty = 0
-                        s.write(cell)
+                        s.write(PIECE_SYMBOLS[piece])
                     else:
                         empty += 1
                 if empty > 0:
                     s.write(str(empty))
-                s.write('/')
-            # Move one position back to overwrite last '/'
-            s.seek(s.tell() - 1)
-            # If you do not have the additional information choose what to put
-            if self.white_to_move:
-                s.write(' {}'.format(self.can_castle))
-            else:
-                s.write(' {}'.format(self.can_castle))
+                if rank < 7:
+                    s.write('/')
+
+            s.write(" w " if self.white_to_move else " b ")
+            s.write(castling_to_string(self.can_castle))
+            s.write(" " + (square_name(self.en_passant) if self.en_passant is not None else "-"))
+            s.write(f" {self.halfmove_clock} {self.fullmove_number}")
             return s.getvalue()
 
-                
+
+    def board_to_epd(self, operations=None):
+        """
+        EPD of the position: the first 4 FEN fields followed by the operations,
+        a dict of opcode to operand (or list of operands) like the one from_epd returns
+        """
+        epd = " ".join(self.board_to_fen().split()[:4])
+        if operations:
+            epd += " " + format_epd_operations(operations)
+
+        return epd
+
+
+    def perft(self, depth):
+        """
+        Counts the leaf nodes of the legal move tree to the given depth
+        The counts are known for standard positions, so they verify castling, en passant and promotion handling
+        """
+        if depth == 0:
+            return 1
+
+        moves = self.legal_moves()
+        # The moves at the last ply do not need to be played to be counted
+        if depth == 1:
+            return len(moves)
+
+        nodes = 0
+        for move in moves:
+            self.make_move(move)
+            nodes += self.perft(depth - 1)
+            self.unmake_move()
+
+        return nodes
+
+
+    def divide(self, depth):
+        """
+        Perft split by root move, returns {uci move: nodes} to find which move a wrong count comes from
+        """
+        counts = {}
+        for move in self.legal_moves():
+            self.make_move(move)
+            counts[move_to_uci(move)] = self.perft(depth - 1)
+            self.unmake_move()
+
+        return counts
+
+
+    @profiled("hash.compute_zobrist_key")
+    def compute_zobrist_key(self):
+        """
+        Computes the Zobrist key of the position from scratch, make_move keeps it up to date incrementally
+        """
+        key = ZOBRIST_CASTLING[self.can_castle]
+        for piece, bitboard in enumerate(self.bitboards):
+            while bitboard:
+                bit = bitboard & -bitboard
+                key ^= ZOBRIST_PIECES[piece][bit.bit_length() - 1]
+                bitboard ^= bit
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.en_passant is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant & 7]
+
+        return key
+
+
+    def repetition_count(self):
+        """
+        Returns how many times the current position has been reached
+        Only positions since the last capture or pawn move with the same side to move can match, so only those keys are compared
+        """
+        key = self.zobrist_key
+        history = self.key_history
+        count = 1
+        for i in range(len(history) - 2, len(history) - self.halfmove_clock - 1, -2):
+            if i < 0:
+                break
+            if history[i] == key:
+                count += 1
+
+        return count
+
+
     def is_threefold_repetition(self):
-        fen_pos = self.board_to_fen()
+        # If the position has been reached 3 or more times, it's threefold repetition
+        return self.repetition_count() >= 3
 
-        # Check if the FEN position is in the dictionary
-        if fen_pos in self.positions:
-            # If it's been reached 3 or more times, it's threefold repetition
-            if self.positions[fen_pos] >= 3:
-                return True
 
-        return False
\ No newline at end of file
+# Legal moves of recent positions, shared by every GameState
+LEGAL_MOVE_CACHE = LegalMoveCache()
@@ -0,0 +1,207 @@
+"""
+Static evaluation: material, piece-square tables and mobility, tapered between the middlegame and the endgame.
+
+Material and piece-square values are kept up to date by GameState itself: every piece added to or removed from the
+board adds or subtracts PIECE_SQUARE[piece][square] to GameState.psqt and PHASE_WEIGHTS[piece] to GameState.phase, so
+evaluate() never has to look at the 64 squares. Only mobility is computed when a position is evaluated.
+
+The middlegame and endgame values are packed into one int (endgame << 16 plus middlegame) so one addition updates both.
+
+evaluate_batch() scores many encoded positions with one NumPy call, for bulk analysis.
+
+This module must not import ChessEngine at module level, ChessEngine imports the tables from here.
+"""
+import numpy as np
+
+from ChessProfile import profiled
+
+# Values by piece type (pawn, rook, knight, bishop, queen, king) in the middlegame and the endgame
+MG_VALUES = [100, 480, 320, 330, 950, 0]
+EG_VALUES = [120, 520, 300, 320, 940, 0]
+
+# Piece-square tables from white's point of view, in square order (a8 first, h1 last), black uses the mirrored square
+PAWN_MG = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    10,  10,  20,  30,  30,  20,  10,  10,
+     5,   5,  10,  25,  25,  10,   5,   5,
+     0,   0,   0,  20,  20,   0,   0,   0,
+     5,  -5, -10,   0,   0, -10,  -5,   5,
+     5,  10,  10, -20, -20,  10,  10,   5,
+     0,   0,   0,   0,   0,   0,   0,   0,
+]
+PAWN_EG = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+    80,  80,  80,  80,  80,  80,  80,  80,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    30,  30,  30,  30,  30,  30,  30,  30,
+    15,  15,  15,  15,  15,  15,  15,  15,
+     5,   5,   5,   5,   5,   5,   5,   5,
+     0,   0,   0,   0,   0,   0,   0,   0,
+     0,   0,   0,   0,   0,   0,   0,   0,
+]
+ROOK_MG = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+     5,  10,  10,  10,  10,  10,  10,   5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+     0,   0,   0,   5,   5,   0,   0,   0,
+]
+ROOK_EG = [0] * 8 + [5] * 8 + [0] * 48
+KNIGHT_MG = [
+   -50, -40, -30, -30, -30, -30, -40, -50,
+   -40, -20,   0,   0,   0,   0, -20, -40,
+   -30,   0,  10,  15,  15,  10,   0, -30,
+   -30,   5,  15,  20,  20,  15,   5, -30,
+   -30,   0,  15,  20,  20,  15,   0, -30,
+   -30,   5,  10,  15,  15,  10,   5, -30,
+   -40, -20,   0,   5,   5,   0, -20, -40,
+   -50, -40, -30, -30, -30, -30, -40, -50,
+]
+KNIGHT_EG = KNIGHT_MG
+BISHOP_MG = [
+   -20, -10, -10, -10, -10, -10, -10, -20,
+   -10,   0,   0,   0,   0,   0,   0, -10,
+   -10,   0,   5,  10,  10,   5,   0, -10,
+   -10,   5,   5,  10,  10,   5,   5, -10,
+   -10,   0,  10,  10,  10,  10,   0, -10,
+   -10,  10,  10,  10,  10,  10,  10, -10,
+   -10,   5,   0,   0,   0,   0,   5, -10,
+   -20, -10, -10, -10, -10, -10, -10, -20,
+]
+BISHOP_EG = BISHOP_MG
+QUEEN_MG = [
+   -20, -10, -10,  -5,  -5, -10, -10, -20,
+   -10,   0,   0,   0,   0,   0,   0, -10,
+   -10,   0,   5,   5,   5,   5,   0, -10,
+    -5,   0,   5,   5,   5,   5,   0,  -5,
+     0,   0,   5,   5,   5,   5,   0,  -5,
+   -10,   5,   5,   5,   5,   5,   0, -10,
+   -10,   0,   5,   0,   0,   0,   0, -10,
+   -20, -10, -10,  -5,  -5, -10, -10, -20,
+]
+QUEEN_EG = QUEEN_MG
+KING_MG = [
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -20, -30, -30, -40, -40, -30, -30, -20,
+   -10, -20, -20, -20, -20, -20, -20, -10,
+    20,  20,   0,   0,   0,   0,  20,  20,
+    20,  30,  10,   0,   0,  10,  30,  20,
+]
+KING_EG = [
+   -50, -40, -30, -20, -20, -30, -40, -50,
+   -30, -20, -10,   0,   0, -10, -20, -30,
+   -30, -10,  20,  30,  30,  20, -10, -30,
+   -30, -10,  30,  40,  40,  30, -10, -30,
+   -30, -10,  30,  40,  40,  30, -10, -30,
+   -30, -10,  20,  30,  30,  20, -10, -30,
+   -30, -30,   0,   0,   0,   0, -30, -30,
+   -50, -30, -30, -30, -30, -30, -30, -50,
+]
+MG_TABLES = [PAWN_MG, ROOK_MG, KNIGHT_MG, BISHOP_MG, QUEEN_MG, KING_MG]
+EG_TABLES = [PAWN_EG, ROOK_EG, KNIGHT_EG, BISHOP_EG, QUEEN_EG, KING_EG]
+
+# Game phase, 24 with all pieces on the board (pure middlegame) down to 0 with only kings and pawns (pure endgame)
+PHASE_BY_TYPE = [0, 2, 1, 1, 4, 0]
+PHASE_WEIGHTS = [PHASE_BY_TYPE[piece >> 1] for piece in range(12)]
+TOTAL_PHASE = 24
+
+# Mobility bonus per square a knight, bishop, rook or queen can move to (middlegame, endgame)
+MOBILITY_MG = [4, 5, 2, 1]
+MOBILITY_EG = [4, 5, 4, 2]
+
+
+def pack(mg, eg):
+    return (eg << 16) + mg
+
+
+def unpack(score):
+    # Inverse of pack, also for sums of packed scores
+    mg = ((score + 0x8000) & 0xFFFF) - 0x8000
+    return mg, (score - mg) >> 16
+
+
+def _piece_square_table():
+    # PIECE_SQUARE[piece][square], packed values from white's point of view (negative for black pieces)
+    table = []
+    for piece in range(12):
+        piece_type = piece >> 1
+        row = []
+        for square in range(64):
+            if piece & 1:
+                mirrored = square ^ 56
+                row.append(-pack(MG_VALUES[piece_type] + MG_TABLES[piece_type][mirrored], EG_VALUES[piece_type] + EG_TABLES[piece_type][mirrored]))
+            else:
+                row.append(pack(MG_VALUES[piece_type] + MG_TABLES[piece_type][square], EG_VALUES[piece_type] + EG_TABLES[piece_type][square]))
+        table.append(row)
+
+    return table
+
+
+PIECE_SQUARE = _piece_square_table()
+
+
+@profiled("eval.evaluate")
+def evaluate(game_state):
+    """
+    Evaluation of the position in centipawns from the side to move's point of view
+    """
+    mg, eg = unpack(game_state.psqt)
+
+    white_mobility = game_state.mobility(True)
+    black_mobility = game_state.mobility(False)
+    for piece_type in range(4):
+        difference = white_mobility[piece_type] - black_mobility[piece_type]
+        mg += MOBILITY_MG[piece_type] * difference
+        eg += MOBILITY_EG[piece_type] * difference
+
+    phase = min(game_state.phase, TOTAL_PHASE)
+    score = (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+    return score if game_state.white_to_move else -score
+
+
+# Tables for evaluate_batch, indexed by piece index with EMPTY (12) for an empty square, like GameState.squares
+EMPTY = 12
+MG_ARRAY = np.zeros((13, 64), dtype=np.int32)
+EG_ARRAY = np.zeros((13, 64), dtype=np.int32)
+for _piece in range(12):
+    for _square in range(64):
+        MG_ARRAY[_piece, _square], EG_ARRAY[_piece, _square] = unpack(PIECE_SQUARE[_piece][_square])
+PHASE_ARRAY = np.array(PHASE_WEIGHTS + [0], dtype=np.int32)
+
+
+def encode_positions(game_states):
+    """
+    Encodes game states as an (N, 64) array of piece indices (EMPTY for empty squares) and an (N,) array of the side to move
+    """
+    boards = np.frombuffer(b"".join(bytes(game_state.squares) for game_state in game_states), dtype=np.uint8).reshape(-1, 64)
+    white_to_move = np.array([game_state.white_to_move for game_state in game_states], dtype=bool)
+    return boards, white_to_move
+
+
+@profiled("eval.evaluate_batch")
+def evaluate_batch(boards, white_to_move=None):
+    """
+    Material and piece-square evaluation of many positions at once
+    boards is an (N, 64) array from encode_positions, returns an (N,) array of scores from white's point of view,
+    or from the side to move's point of view if white_to_move is given
+    Mobility needs the attack tables of every position, so it is left out of the batch scores
+    """
+    boards = np.asarray(boards, dtype=np.intp)
+    squares = np.arange(64)
+    mg = MG_ARRAY[boards, squares].sum(axis=1)
+    eg = EG_ARRAY[boards, squares].sum(axis=1)
+    phase = np.minimum(PHASE_ARRAY[boards].sum(axis=1), TOTAL_PHASE)
+
+    scores = (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+    if white_to_move is not None:
+        scores = np.where(white_to_move, scores, -scores)
+
+    return scores
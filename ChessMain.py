@@ -1,13 +1,29 @@
+import os
+import queue
+import threading
 import pygame
-import time
-import numpy as np
 
 from ChessEngine import *
+from ChessBook import OpeningBook
+from ChessPGN import game_to_pgn
+from ChessProfile import timer
+from ChessSearch import Searcher
+from ChessTablebase import Tablebases
+from ChessTransposition import TranspositionTable
 
 # Global Variables
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 800
 SQUARE_SIZE = (WINDOW_WIDTH) // 8
+PROMOTION_PANEL = pygame.Rect(SQUARE_SIZE * 1.9, SQUARE_SIZE * 3.1, SQUARE_SIZE * 4.2, SQUARE_SIZE * 1.8)
+PGN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games.pgn") # Played games are added to this file when the window is closed
+ENGINE_COLOR = None # None for two players, True for the engine to play white, False for black
+ENGINE_TIME = 2.0 # Seconds the engine thinks per move
+BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin") # Polyglot opening book, used if it exists
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases") # Endgame tables (python ChessTablebase.py)
+ENGINE_EVENT = pygame.USEREVENT + 1 # Posted by the engine worker when a job is done
+FRAME_RATE = 60 # Frames per second at most, the loop sleeps until an event comes when nothing happens
+PIECES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chesspieces")
 piece_type_from_symbol = {
     "K": "w_king", "k": "b_king", "Q": "w_queen", "q": "b_queen", "B": "w_bishop", "b": "b_bishop", "N": "w_knight", "n": "b_knight",
     "R": "w_rook", "r": "b_rook", "P": "w_pawn", "p": "b_pawn"
@@ -20,23 +36,72 @@ class graphicalBoard():
         self.highlighted_piece = None
         self.font = pygame.font.Font('freesansbold.ttf', 64)
 
+        # Sprite and piece symbol shown on every square, sprites of captured pieces are kept to be reused
+        self.square_sprites = [None] * 64
+        self.square_symbols = [None] * 64
+        self.free_sprites = []
+
+        # Only what changed is drawn: the squares to redraw (every square at first), the highlighted squares,
+        # and the end of game text shown over the board
+        self.dirty_squares = set(range(64))
+        self.special_squares = set()
+        self.message = None
+
     
-    # Draws chess board 
+    # Highlights the special squares (the moves of the selected piece), only squares that change color are redrawn
     def draw_graphical_board(self, special_squares=None):
 
-        for file in range(8):
-            for rank in range(8):
-                
-                # Alternate square color based on file and rank
-                square_color = (162, 119, 98) if (file + rank) % 2 else (241, 218, 193)
+        special_squares = set(special_squares) if special_squares is not None else set()
+        for rank, file in special_squares ^ self.special_squares:
+            self.dirty_squares.add(rank * 8 + file)
+        self.special_squares = special_squares
+
+
+    def draw_square(self, square):
+
+        rank, file = divmod(square, 8)
+
+        # Alternate square color based on file and rank
+        square_color = (162, 119, 98) if (file + rank) % 2 else (241, 218, 193)
+
+        # Special squares are select pieces
+        if (rank, file) in self.special_squares:
+            square_color = (0, 204, 204)
+
+        rect = pygame.Rect(SQUARE_SIZE * file, SQUARE_SIZE * rank, SQUARE_SIZE, SQUARE_SIZE)
+        pygame.draw.rect(screen, square_color, rect, 0)
+
+        sprite = self.square_sprites[square]
+        if sprite is not None:
+            screen.blit(sprite.image, sprite.rect)
+
+        return rect
+
+
+    def update_display(self):
+        """
+        Redraws the squares that changed and updates only their part of the window
+        """
+        if not self.dirty_squares:
+            return
+
+        rects = [self.draw_square(square) for square in self.dirty_squares]
+        self.dirty_squares.clear()
+
+        if self.message is not None:
+            text, text_rect = self.message
+            screen.blit(text, text_rect)
+            rects.append(text_rect)
+
+        pygame.display.update(rects)
 
-                # Special squares are select pieces
-                if special_squares is not None:
-                    if (rank, file) in special_squares:
-                        square_color = (0, 204, 204)
 
-                # Draw rectangles, creating the 8x8 grid
-                pygame.draw.rect(screen, square_color, [SQUARE_SIZE * file, SQUARE_SIZE * rank, SQUARE_SIZE, SQUARE_SIZE], 0)
+    def mark_dirty(self, rect):
+        # Squares under a rect (like the promotion panel) are redrawn on the next update
+        rect = pygame.Rect(rect).clip(screen.get_rect())
+        for rank in range(rect.top // SQUARE_SIZE, (rect.bottom - 1) // SQUARE_SIZE + 1):
+            for file in range(rect.left // SQUARE_SIZE, (rect.right - 1) // SQUARE_SIZE + 1):
+                self.dirty_squares.add(rank * 8 + file)
 
 
     # Function to center the piece within the square
@@ -60,41 +125,57 @@ class graphicalBoard():
                 rank += 1
             else:
                 if symbol.isnumeric():
-                    file += int(symbol)
+                    for _ in range(int(symbol)):
+                        self.place_piece(rank, file, None)
+                        file += 1
                 else:
-                    #fLoad images of chess pieces
-                    piece_type = piece_type_from_symbol[symbol]
-                    piece_img = pygame.image.load("chesspieces\{}.png".format(piece_type)).convert_alpha()
-
-                    # Create a sprite for each chess piece and add it to the group
-                    sprite = Sprite(piece_img, SQUARE_SIZE * file, SQUARE_SIZE * rank)
-                    chess_sprites_list.add(sprite)
-
+                    self.place_piece(rank, file, symbol)
                     file += 1
 
     def place_pieces_from_board(self, board):
 
-        chess_sprites_list.empty
-
+        # Only the squares that changed since the last call touch their sprite
         for rank in range(8):
+            row = board[rank]
             for file in range(8):
+                self.place_piece(rank, file, row[file])
 
-                symbol = board[rank][file]
-                
-                if symbol:
-                    piece_type = piece_type_from_symbol[symbol]
-                    piece_img = pygame.image.load("chesspieces\{}.png".format(piece_type)).convert_alpha()
 
-                    sprite = Sprite(piece_img, SQUARE_SIZE * file, SQUARE_SIZE * rank)
-                    chess_sprites_list.add(sprite)
+    def place_piece(self, rank, file, symbol):
+        """
+        Shows symbol's piece (None for an empty square) on the square, reusing sprites instead of making new ones
+        """
+        square = rank * 8 + file
+        if self.square_symbols[square] == symbol:
+            return
+        self.square_symbols[square] = symbol
+        self.dirty_squares.add(square)
 
-        pygame.display.update()
+        sprite = self.square_sprites[square]
+        if sprite is not None:
+            chess_sprites_list.remove(sprite)
+            self.free_sprites.append(sprite)
+            self.square_sprites[square] = None
+
+        if symbol:
+            image = piece_images.image(symbol)
+            if self.free_sprites:
+                sprite = self.free_sprites.pop()
+                sprite.move(image, SQUARE_SIZE * file, SQUARE_SIZE * rank)
+            else:
+                sprite = Sprite(image, SQUARE_SIZE * file, SQUARE_SIZE * rank)
+            chess_sprites_list.add(sprite)
+            self.square_sprites[square] = sprite
 
 
     def remove_sprites(self):
 
         for sprite in chess_sprites_list:
             chess_sprites_list.remove(sprite)
+            self.free_sprites.append(sprite)
+        self.square_sprites = [None] * 64
+        self.square_symbols = [None] * 64
+        self.dirty_squares.update(range(64))
 
 
     # Map the pygame coordinates to squares on board
@@ -107,17 +188,11 @@ class graphicalBoard():
 
     def pawn_promote_selection(self, color):
 
-        color = 'w' if color else 'b'
-
-        # Load image pieces and put them in an array
-        queen_img = pygame.image.load("chesspieces\{}_queen.png".format(color)).convert_alpha()
-        rook_img = pygame.image.load("chesspieces\{}_rook.png".format(color)).convert_alpha()
-        bishop_img = pygame.image.load("chesspieces\{}_bishop.png".format(color)).convert_alpha()
-        knight_img = pygame.image.load("chesspieces\{}_knight.png".format(color)).convert_alpha()
-        images = np.array([queen_img, rook_img, bishop_img, knight_img])
+        # Images of the pieces to choose from, in the order they are shown
+        images = [piece_images.image(symbol if color else symbol.lower()) for symbol in "QRBN"]
 
         # Background to piece selection
-        pygame.draw.rect(screen, (32, 32, 32), [SQUARE_SIZE * 1.9, SQUARE_SIZE * 3.1, SQUARE_SIZE * 4.2, SQUARE_SIZE * 1.8], 0)
+        pygame.draw.rect(screen, (32, 32, 32), PROMOTION_PANEL, 0)
 
         # Background to individual pieces in selection screen
         pygame.draw.rect(screen, (74, 74, 74), [SQUARE_SIZE * 2, SQUARE_SIZE * 3.5, SQUARE_SIZE, SQUARE_SIZE], 0)
@@ -132,47 +207,54 @@ class graphicalBoard():
 
         promotion_selection_list.update(events)
         promotion_selection_list.draw(screen)
+        pygame.display.update(PROMOTION_PANEL)
 
 
     def promotion_loop(self, chess_game, new_rank, new_file, color):
         selection = True
         while selection:
-            events = pygame.event.get()
+            # Sleeps until the player clicks
+            events = [pygame.event.wait()] + pygame.event.get()
             for event in events:
                 # Clicked position is mapped to a chess board square
                 if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                     pos_x, pos_y = event.pos
 
                     if 300 >= pos_x >= 200 and 450 >= pos_y >= 350:
-                        piece = "Q" if color else "q"
-                        chess_game.board[new_rank][new_file] = piece
+                        self.promote(chess_game, QUEEN)
                         selection = False
                         break
 
                     elif 400 >= pos_x > 300 and 450 >= pos_y >= 350:
-                        piece = "R" if color else "r"
-                        chess_game.board[new_rank][new_file] = piece
+                        self.promote(chess_game, ROOK)
                         selection = False
                         break
 
                     elif 500 >= pos_x > 400 and 450 >= pos_y >= 350:
-                        piece = "B" if color else "b"
-                        chess_game.board[new_rank][new_file] = piece
+                        self.promote(chess_game, BISHOP)
                         selection = False
                         break
 
                     elif 600 >= pos_x > 500 and 450 >= pos_y >= 350:
-                        piece = "N" if color else "n"
-                        chess_game.board[new_rank][new_file] = piece
+                        self.promote(chess_game, KNIGHT)
                         selection = False
                         break
 
-        if color == 'w':
-            chess_game.white_promote = False 
-        elif color == 'b':
+        promotion_selection_list.empty()
+        self.mark_dirty(PROMOTION_PANEL)
+        if color:
+            chess_game.white_promote = False
+        else:
             chess_game.black_promote = False
 
 
+    def promote(self, chess_game, promotion):
+        # Plays the promotion again with the chosen piece, so the move history (and the saved game) has the right piece
+        old_pos, _, new_pos = chess_game.last_move
+        chess_game.unmake_move()
+        chess_game.make_move(chess_game.find_move(old_pos, new_pos, promotion))
+
+
     def end(self, color, screen, end_type):
 
         if end_type == 1:
@@ -188,9 +270,31 @@ class graphicalBoard():
         textRect = text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
         textRect.center = (WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2)
 
-        screen.blit(text, textRect)
-        
-        pygame.display.update()
+        # Drawn over the board on every update from now on
+        self.message = (text, textRect)
+        self.mark_dirty(textRect)
+
+
+class PieceImages():
+    """
+    The 12 piece images, loaded from disk and converted to the display format once, side by side in one atlas surface
+    image(symbol) is that piece's part of the atlas, a subsurface, so drawing a piece never copies or converts an image
+    Needs the display to be set up first
+    """
+    def __init__(self, directory=PIECES_DIR):
+        symbols = list(piece_type_from_symbol)
+        images = [pygame.image.load(os.path.join(directory, piece_type_from_symbol[symbol] + ".png")) for symbol in symbols]
+        width = max(image.get_width() for image in images)
+        height = max(image.get_height() for image in images)
+
+        self.atlas = pygame.Surface((width * len(images), height), pygame.SRCALPHA).convert_alpha()
+        self.images = {}
+        for index, (symbol, image) in enumerate(zip(symbols, images)):
+            self.atlas.blit(image, (index * width, 0))
+            self.images[symbol] = self.atlas.subsurface((index * width, 0, image.get_width(), image.get_height()))
+
+    def image(self, symbol):
+        return self.images[symbol]
 
 
 # Chess piece sprite class
@@ -208,6 +312,73 @@ class Sprite(pygame.sprite.Sprite):
         self.rect.height = SQUARE_SIZE
         self.rect.topleft = [pos_x + 15, pos_y]
 
+    # Shows another piece image at another position, so a sprite can be reused
+    def move(self, image, pos_x, pos_y):
+        self.image = image
+        self.rect.topleft = [pos_x + 15, pos_y]
+
+
+
+def game_status(game_state):
+    """
+    0 if the game goes on, 1 for checkmate, 2 for stalemate or threefold repetition
+    """
+    if game_state.king_in_check(game_state.white_to_move):
+        if game_state.king_in_checkmate(game_state.white_to_move):
+            return 1
+
+    elif game_state.is_stalemate(game_state.white_to_move):
+        return 2
+
+    elif game_state.is_threefold_repetition():
+        return 2
+
+    return 0
+
+
+class EngineWorker():
+    """
+    Background thread for the engine work after a move (the game over check and the engine's reply),
+    so the window keeps responding while it runs
+    Jobs work on a copy of the game state, results are posted as ENGINE_EVENT events with the job number,
+    kind ("status" or "move") and result (the game status, or the engine's move with None if it was cancelled)
+    """
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.job_number = 0
+        self.stop_event = threading.Event() # Of the newest job, set to cancel it
+        self.table = TranspositionTable()
+        self.book = OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
+        self.tablebases = Tablebases(TABLEBASE_DIR) if os.path.isdir(TABLEBASE_DIR) else None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, kind, game_state):
+        # Queues a job and returns its number, only results with the newest number are used
+        self.job_number += 1
+        self.stop_event = threading.Event()
+        self.jobs.put((self.job_number, kind, game_state.copy(), self.stop_event))
+        return self.job_number
+
+    def cancel(self):
+        self.stop_event.set()
+
+    def run(self):
+        while True:
+            number, kind, game_state, stop_event = self.jobs.get()
+            if kind == "status":
+                result = game_status(game_state)
+            else:
+                # Book moves are played without searching
+                result = self.book.choose(game_state) if self.book is not None else None
+                if result is None:
+                    searcher = Searcher(game_state, info=None, table=self.table)
+                    searcher.stop_event = stop_event
+                    # Endings in the tables are played perfectly and at once
+                    searcher.tablebases = self.tablebases
+                    result, score, pv = searcher.search(time_limit=ENGINE_TIME)
+                    if stop_event.is_set():
+                        result = None
+            pygame.event.post(pygame.event.Event(ENGINE_EVENT, job=number, kind=kind, result=result))
 
 
 # Initialize Pygame
@@ -217,6 +388,9 @@ pygame.init()
 screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
 pygame.display.set_caption("Chess")
 
+# Piece images are loaded once, every sprite draws from the same atlas
+piece_images = PieceImages()
+
 # Create game state
 chess_game = GameState()
 chess_game.place_pieces_from_fen()
@@ -227,27 +401,68 @@ chess_sprites_list = pygame.sprite.Group()
 promotion_selection_list = pygame.sprite.Group()
 
 # Draw the initial board
-tic = time.perf_counter()
-graphical_board.draw_graphical_board()
-graphical_board.place_pieces_from_fen(chess_game.starting_pos)
-pygame.display.update()
-toc = time.perf_counter()
-print(f"Generated board in {toc - tic:0.4f} seconds")
+with timer("ui.initial_board"):
+    graphical_board.draw_graphical_board()
+    graphical_board.place_pieces_from_fen(chess_game.starting_pos)
+    graphical_board.update_display()
+
+
+# Mouse movement is not used, it would only wake the loop up
+pygame.event.set_blocked(pygame.MOUSEMOTION)
+clock = pygame.time.Clock()
+
+# The engine works in the background, the board takes no moves while it is thinking
+engine_worker = EngineWorker()
+thinking = None # Number of the job the board is waiting for
+
 
+def start_thinking(kind):
+    global thinking
+    thinking = engine_worker.submit(kind, chess_game)
+    pygame.display.set_caption("Chess - thinking... (Esc to cancel)")
+
+
+def stop_thinking():
+    global thinking
+    thinking = None
+    pygame.display.set_caption("Chess")
+
+
+# The engine may have the first move
+if ENGINE_COLOR == chess_game.white_to_move:
+    start_thinking("move")
 
 # Main game loop
 end = False
 running = True
 while running:
-        
-    events = pygame.event.get()
 
-    chess_sprites_list.update(events)
-    chess_sprites_list.draw(screen) 
-    pygame.display.update()
+    # Sleeps until something happens, then handles everything that is waiting
+    events = [pygame.event.wait()] + pygame.event.get()
 
     for event in events:
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+        if event.type == ENGINE_EVENT and event.job == thinking:
+            stop_thinking()
+
+            if event.kind == "status":
+                end = event.result
+                if end:
+                    graphical_board.end(not chess_game.white_to_move, screen, end)
+                elif ENGINE_COLOR == chess_game.white_to_move:
+                    start_thinking("move")
+
+            # The engine's move, None if the search was cancelled (the player can make the move instead)
+            elif event.result is not None:
+                chess_game.make_move(event.result)
+                chess_game.white_promote = chess_game.black_promote = False
+                graphical_board.place_pieces_from_board(chess_game.board)
+                start_thinking("status")
+
+        # Esc cancels the engine's work
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE and thinking is not None:
+            engine_worker.cancel()
+
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and thinking is None:
 
             # Clicked position is mapped to a chess board square
             pos_x, pos_y = event.pos
@@ -275,17 +490,12 @@ while running:
             elif graphical_board.selected_piece and not end:
 
                 # Makes the move on the chess_game board if it is legal and updates the game state
-                tic = time.perf_counter()
                 moves = chess_game.generate_moves(graphical_board.selected_piece)
-                toc = time.perf_counter()
-                print(f"Generated moves in {toc - tic:0.6f} seconds")
                 if clicked_square in moves:
 
-                    # Save last move in the chess_game object
                     new_rank, new_file = clicked_square
                     piece_rank, piece_file = graphical_board.selected_piece
                     piece_type = chess_game.board[piece_rank][piece_file]
-                    chess_game.last_move = [graphical_board.selected_piece, piece_type, clicked_square]
 
                     color = True if piece_type.isupper() else False
 
@@ -294,37 +504,35 @@ while running:
                     if chess_game.white_promote or chess_game.black_promote:
 
                         # Redraws the updated board
-                        graphical_board.remove_sprites()
                         graphical_board.place_pieces_from_board(chess_game.board)
+                        graphical_board.update_display()
                         graphical_board.pawn_promote_selection(not chess_game.white_to_move)
-                        pygame.display.update()
 
                         graphical_board.promotion_loop(chess_game, new_rank, new_file, not chess_game.white_to_move)
 
-                    if chess_game.king_in_check(chess_game.white_to_move):
-                        if chess_game.king_in_checkmate(chess_game.white_to_move):
-                            end = 1
-
-                    elif chess_game.is_stalemate(chess_game.white_to_move):
-                        end = 2
-
-                    elif chess_game.is_threefold_repetition():
-                        end = 2                                      
-                
-                    # Redraws the updated board
-                    graphical_board.remove_sprites()
+                    # Moves the sprites of the squares that changed
                     graphical_board.place_pieces_from_board(chess_game.board)
 
+                    # Checkmate, stalemate and repetition are checked in the background
+                    start_thinking("status")
+
                 graphical_board.selected_piece = None
 
                 graphical_board.draw_graphical_board()
 
-                if end == 1: 
-                    graphical_board.end(not chess_game.white_to_move, screen, 1)
-                elif end == 2:
-                    graphical_board.end(not chess_game.white_to_move, screen, 2)
-
 
         # End loop if user exits
         if event.type == pygame.QUIT:
-            running = False
\ No newline at end of file
+            running = False
+
+    # Draws the squares that changed, at most FRAME_RATE times per second
+    with timer("ui.update_display"):
+        graphical_board.update_display()
+    clock.tick(FRAME_RATE)
+
+
+# Save the game to the PGN file
+if chess_game.undo_stack:
+    with open(PGN_FILE, "a") as pgn_file:
+        pgn_file.write(game_to_pgn(chess_game, {"Event": "Casual game", "White": "Engine" if ENGINE_COLOR is True else "Player",
+                                                "Black": "Engine" if ENGINE_COLOR is False else "Player"}))
@@ -0,0 +1,120 @@
+"""
+Move ordering for the search.
+
+Alpha-beta cuts off as soon as a move refutes the position, so the earlier the best move is searched the fewer moves are
+searched at all. MoveOrderer hands out the moves of a position in stages and only generates a stage when the search
+gets to it, so a cutoff on an early move never pays for generating the quiet moves:
+    1. the hash move (from the principal variation or the transposition table)
+    2. captures and promotions, most valuable victim first and then least valuable attacker (MVV-LVA)
+    3. the killer moves of the ply, quiet moves that caused a cutoff in a sibling position
+    4. the other quiet moves, ordered by the history heuristic (how often the move caused a cutoff so far)
+"""
+from ChessEngine import EMPTY, MOVES_NOISY, MOVES_QUIET, MOVE_PROMOTION_SHIFT, FLAG_EN_PASSANT, QUEEN, PAWN
+
+# Ordering values by piece type (pawn, rook, knight, bishop, queen, king)
+ORDER_VALUES = [1, 5, 3, 3, 9, 20]
+KILLERS_PER_PLY = 2
+
+
+class MoveOrderer():
+    """
+    Killer moves and history scores of one search, kept between the iterations of iterative deepening
+    """
+
+    def __init__(self, max_ply):
+        self.killers = [[0] * KILLERS_PER_PLY for _ in range(max_ply + 1)]
+        # history[piece][to square], raised by depth * depth every time a quiet move causes a cutoff
+        self.history = [[0] * 64 for _ in range(12)]
+
+        # Cutoff statistics, a well ordered search cuts off on the first move most of the time
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+
+    def new_search(self):
+        """
+        Clears the killer moves and the statistics, history scores are halved so older searches count for less
+        """
+        for killers in self.killers:
+            killers[:] = [0] * KILLERS_PER_PLY
+        for scores in self.history:
+            for square in range(64):
+                scores[square] >>= 1
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+
+    def ordered_moves(self, game_state, ply, first_move=0):
+        """
+        Yields the legal moves of the position in the order they should be searched
+        The game state may be changed between moves as long as it is back in the position when the next move is asked for
+        """
+        if first_move and game_state.is_legal(first_move):
+            yield first_move
+        else:
+            first_move = 0
+
+        squares = game_state.squares
+        noisy = game_state.legal_moves(MOVES_NOISY)
+        if first_move in noisy:
+            noisy.remove(first_move)
+        noisy.sort(key=lambda move: mvv_lva(squares, move), reverse=True)
+        yield from noisy
+
+        # Killer moves are quiet moves from another position, they are used if they are legal and still quiet here
+        killers = []
+        for killer in self.killers[ply]:
+            if killer and killer != first_move and squares[killer >> 6 & 63] == EMPTY and not killer & FLAG_EN_PASSANT \
+                    and not killer >> MOVE_PROMOTION_SHIFT & 7 and game_state.is_legal(killer):
+                killers.append(killer)
+                yield killer
+
+        history = self.history
+        quiet = [move for move in game_state.legal_moves(MOVES_QUIET) if move != first_move and move not in killers]
+        quiet.sort(key=lambda move: history[squares[move & 63]][move >> 6 & 63], reverse=True)
+        yield from quiet
+
+
+    def cutoff(self, game_state, move, depth, ply, index):
+        """
+        Records that move caused a beta cutoff, index is its position in the order the moves were searched
+        Quiet moves become killer moves of the ply and raise their history score
+        """
+        self.cutoffs += 1
+        if index == 0:
+            self.first_move_cutoffs += 1
+
+        if game_state.is_capture(move) or move >> MOVE_PROMOTION_SHIFT & 7:
+            return
+
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[game_state.squares[move & 63]][move >> 6 & 63] += depth * depth
+
+
+    def first_move_cutoff_rate(self):
+        # Share of the cutoffs that happened on the first move searched
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+
+def mvv_lva(squares, move):
+    """
+    Ordering score of a capture or promotion, higher is searched first
+    Under-promotions are scored below every capture, they are almost never better than a queen
+    """
+    score = 0
+    victim = squares[move >> 6 & 63]
+    if victim != EMPTY or move & FLAG_EN_PASSANT:
+        # En passant captures a pawn that is not on the target square
+        victim_type = victim >> 1 if victim != EMPTY else PAWN
+        score = ORDER_VALUES[victim_type] * 32 - ORDER_VALUES[squares[move & 63] >> 1]
+
+    promotion = move >> MOVE_PROMOTION_SHIFT & 7
+    if promotion == QUEEN:
+        score += ORDER_VALUES[QUEEN] * 32
+    elif promotion:
+        score -= 1000
+
+    return score
@@ -0,0 +1,347 @@
+"""
+PGN reading and writing, and SAN (standard algebraic notation) for encoded moves.
+
+read_games(stream) is a generator: it reads the file line by line and yields one PGNGame at a time, so a database of
+any size is processed with the memory of a single game. The SAN moves of every game are resolved against
+GameState.legal_moves and replayed, a game with an illegal or unreadable move keeps the moves before it and gets an error.
+
+    with open("games.pgn", encoding="utf-8", errors="replace") as stream:
+        for game in read_games(stream):
+            print(game.headers.get("White"), len(game.moves), game.result)
+
+write_game / game_to_pgn write a game (for example one played in ChessMain) back as PGN.
+"""
+import io
+import re
+import time
+
+from ChessEngine import GameState, PAWN, KING, FILE_A, FLAG_CASTLE, MOVE_PROMOTION_SHIFT, W_KING, square_name, parse_square
+
+STANDARD_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# Tags every PGN game starts with, in this order
+SEVEN_TAG_ROSTER = [("Event", "?"), ("Site", "?"), ("Date", "????.??.??"), ("Round", "?"), ("White", "?"), ("Black", "?"), ("Result", "*")]
+
+# SAN letters by piece type (pawn, rook, knight, bishop, queen, king)
+SAN_PIECES = "PRNBQK"
+LINE_LENGTH = 80
+
+HEADER_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# Comments, NAGs, variations, results, move numbers, and everything else is a move
+TOKEN_RE = re.compile(r'\{[^}]*\}?|;[^\n]*|\$\d+|[()]|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{}();$]+')
+
+
+class PGNGame():
+    """
+    One game of a PGN file: its tags, encoded moves, result and the error that stopped reading its moves (None if all
+    moves were read)
+    """
+    __slots__ = ("headers", "moves", "result", "error")
+
+    def __init__(self, headers=None, moves=None, result="*", error=None):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []
+        self.result = result
+        self.error = error
+
+
+    def start_fen(self):
+        # Games that do not start from the standard position have a FEN tag
+        return self.headers.get("FEN", STANDARD_FEN)
+
+
+    def game_state(self):
+        """
+        GameState of the final position, replayed from the start
+        """
+        game_state = GameState.from_fen(self.start_fen())
+        for move in self.moves:
+            game_state.make_move(move)
+        return game_state
+
+
+def parse_san(game_state, san):
+    """
+    Returns the encoded legal move for a SAN move like "Nbd7", "exd8=Q+" or "O-O"
+    Raises ValueError if the move is illegal, ambiguous or cannot be read
+    """
+    text = san
+    san = san.rstrip("+#!?")
+    color = 0 if game_state.white_to_move else 1
+
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingside = len(san) == 3
+        for move in game_state.legal_moves(from_mask=game_state.bitboards[W_KING + color]):
+            if move & FLAG_CASTLE and ((move >> 6 & 63) > (move & 63)) == kingside:
+                return move
+        raise ValueError("illegal castling: " + text)
+
+    promotion = 0
+    if "=" in san:
+        san, letter = san.split("=", 1)
+        promotion = SAN_PIECES.index(letter.upper()[:1] or "?")
+    elif len(san) > 2 and san[-1] in "QRBN" and san[-2] in "18":
+        # Promotion without the "=", like e8Q
+        promotion = SAN_PIECES.index(san[-1])
+        san = san[:-1]
+
+    if san and san[0] in "KQRBN":
+        piece_type = SAN_PIECES.index(san[0])
+        san = san[1:]
+    else:
+        piece_type = PAWN
+
+    san = san.replace("x", "").replace("-", "")
+    if len(san) < 2 or san[-2] not in "abcdefgh" or san[-1] not in "12345678":
+        raise ValueError("cannot read move: " + text)
+    to = parse_square(san[-2:])
+
+    # Disambiguation by file and/or rank limits the squares the piece can come from
+    from_mask = game_state.bitboards[piece_type * 2 + color]
+    for char in san[:-2]:
+        if char in "abcdefgh":
+            from_mask &= FILE_A << (ord(char) - 97)
+        elif char in "12345678":
+            from_mask &= 0xFF << (8 * (56 - ord(char)))
+        else:
+            raise ValueError("cannot read move: " + text)
+
+    found = None
+    for move in game_state.legal_moves(from_mask=from_mask):
+        if move >> 6 & 63 == to and move >> MOVE_PROMOTION_SHIFT & 7 == promotion:
+            if found is not None:
+                raise ValueError("ambiguous move: " + text)
+            found = move
+
+    if found is None:
+        raise ValueError("illegal move: " + text)
+    return found
+
+
+def move_to_san(game_state, move):
+    """
+    SAN of a legal move in the position, with + or # if it gives check or mate
+    """
+    from_square = move & 63
+    to = move >> 6 & 63
+    piece = game_state.squares[from_square]
+    piece_type = piece >> 1
+
+    if move & FLAG_CASTLE:
+        san = "O-O" if to > from_square else "O-O-O"
+    elif piece_type == PAWN:
+        san = square_name(from_square)[0] + "x" if game_state.is_capture(move) else ""
+        san += square_name(to)
+        promotion = move >> MOVE_PROMOTION_SHIFT & 7
+        if promotion:
+            san += "=" + SAN_PIECES[promotion]
+    else:
+        san = SAN_PIECES[piece_type]
+        if piece_type != KING:
+            # Other pieces of the same kind that can move to the same square decide the disambiguation
+            others = [other & 63 for other in game_state.legal_moves(from_mask=game_state.bitboards[piece] ^ (1 << from_square))
+                      if other >> 6 & 63 == to]
+            if others:
+                if all(other & 7 != from_square & 7 for other in others):
+                    san += square_name(from_square)[0]
+                elif all(other >> 3 != from_square >> 3 for other in others):
+                    san += square_name(from_square)[1]
+                else:
+                    san += square_name(from_square)
+        if game_state.is_capture(move):
+            san += "x"
+        san += square_name(to)
+
+    game_state.make_move(move)
+    if game_state.king_in_check(game_state.white_to_move):
+        san += "#" if not game_state.legal_moves() else "+"
+    game_state.unmake_move()
+
+    return san
+
+
+def _parse_movetext(game, movetext):
+    # Resolves the SAN moves of the movetext, variations and comments are skipped
+    try:
+        game_state = GameState.from_fen(game.start_fen())
+    except (ValueError, KeyError, IndexError):
+        game.error = "bad FEN tag: " + game.start_fen()
+        return
+
+    variation_depth = 0
+    for token in TOKEN_RE.findall(movetext):
+        first = token[0]
+        if first == "(":
+            variation_depth += 1
+        elif first == ")":
+            variation_depth -= 1
+        elif variation_depth or first in "{;$" or first.isdigit() and token.endswith("."):
+            continue
+        elif token in RESULTS:
+            # The result ends the game, read_games starts the next one after it
+            game.result = token
+            break
+        elif game.error is None:
+            try:
+                move = parse_san(game_state, token)
+            except ValueError as error:
+                game.error = f"move {len(game.moves) // 2 + 1}: {error}"
+                continue
+            game_state.make_move(move)
+            game.moves.append(move)
+
+
+def _find_result(text, variation_depth):
+    # End of the first result in the movetext that is not in a comment or variation (-1 if there is none),
+    # and the variation depth after the text
+    for match in TOKEN_RE.finditer(text):
+        token = match.group()
+        if token == "(":
+            variation_depth += 1
+        elif token == ")":
+            variation_depth -= 1
+        elif not variation_depth and token in RESULTS:
+            return match.end(), variation_depth
+    return -1, variation_depth
+
+
+def read_games(stream):
+    """
+    Yields the games of a PGN text stream (a file opened in text mode, or any iterable of lines) one at a time
+    A game ends at its result or at the tags of the next game, so games without tags are read one by one too
+    """
+    game = None
+    movetext = []
+    open_comment = False
+    variation_depth = 0
+
+    for line in stream:
+        # A comment in braces can go over several lines, nothing in it starts a new game
+        if open_comment:
+            close = line.find("}")
+            if close < 0:
+                if game is not None:
+                    movetext.append(line)
+                continue
+            # The rest of the line after the comment is movetext again
+            if game is not None:
+                movetext.append(line[:close + 1])
+            open_comment = False
+            line = line[close + 1:]
+
+        if line.startswith("%"):
+            continue
+        line = line.strip()
+        if not line:
+            continue
+
+        if line[0] == "[":
+            # Tags after movetext start the next game
+            if movetext:
+                _parse_movetext(game, "\n".join(movetext))
+                yield game
+                game = None
+                movetext = []
+                variation_depth = 0
+            if game is None:
+                game = PGNGame()
+            header = HEADER_RE.match(line)
+            if header:
+                game.headers[header.group(1)] = header.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+
+        while line:
+            if game is None:
+                # Comments between games belong to no game
+                if all(token[0] in "{;" for token in TOKEN_RE.findall(line)):
+                    open_comment = line.rfind("{") > line.rfind("}")
+                    break
+                game = PGNGame()
+            end, variation_depth = _find_result(line, variation_depth)
+            if end < 0:
+                movetext.append(line)
+                open_comment = line.rfind("{") > line.rfind("}")
+                break
+
+            movetext.append(line[:end])
+            _parse_movetext(game, "\n".join(movetext))
+            yield game
+            game = None
+            movetext = []
+            variation_depth = 0
+            line = line[end:].strip()
+
+    if game is not None:
+        _parse_movetext(game, "\n".join(movetext))
+        yield game
+
+
+def _wrap(tokens):
+    # Joins the tokens into lines of at most LINE_LENGTH characters
+    lines = []
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+
+    return "\n".join(lines)
+
+
+def game_result(game_state):
+    # Result of the game if it is over in the position, "*" otherwise
+    if not game_state.legal_moves():
+        if game_state.king_in_check(game_state.white_to_move):
+            return "0-1" if game_state.white_to_move else "1-0"
+        return "1/2-1/2"
+    if game_state.is_threefold_repetition() or game_state.halfmove_clock >= 100:
+        return "1/2-1/2"
+    return "*"
+
+
+def write_game(stream, moves, headers=None, start_fen=None, result=None):
+    """
+    Writes a game as PGN: the seven tag roster (filled from headers), any other headers and the movetext
+    moves are encoded moves from start_fen (the standard position if None), the result is worked out if not given
+    """
+    game_state = GameState.from_fen(start_fen or STANDARD_FEN)
+    tokens = []
+    for move in moves:
+        if game_state.white_to_move:
+            tokens.append(f"{game_state.fullmove_number}.")
+        elif not tokens:
+            tokens.append(f"{game_state.fullmove_number}...")
+        tokens.append(move_to_san(game_state, move))
+        game_state.make_move(move)
+
+    headers = dict(headers or {})
+    if result is None:
+        result = headers.get("Result") if headers.get("Result") in RESULTS else game_result(game_state)
+    headers["Result"] = result
+    if start_fen and start_fen != STANDARD_FEN:
+        headers["SetUp"] = "1"
+        headers["FEN"] = start_fen
+    tokens.append(result)
+
+    for tag, default in SEVEN_TAG_ROSTER:
+        stream.write('[{} "{}"]\n'.format(tag, str(headers.get(tag, default)).replace("\\", "\\\\").replace('"', '\\"')))
+    for tag, value in headers.items():
+        if tag not in dict(SEVEN_TAG_ROSTER):
+            stream.write('[{} "{}"]\n'.format(tag, str(value).replace("\\", "\\\\").replace('"', '\\"')))
+    stream.write("\n" + _wrap(tokens) + "\n\n")
+
+
+def game_to_pgn(game_state, headers=None, result=None):
+    """
+    PGN of the moves played on a game state (from its starting position), like a game from ChessMain
+    """
+    headers = dict(headers or {})
+    headers.setdefault("Date", time.strftime("%Y.%m.%d"))
+    start_fen = GameState.from_fen(game_state.starting_pos).board_to_fen()
+
+    stream = io.StringIO()
+    write_game(stream, [record[0] for record in game_state.undo_stack], headers, start_fen, result)
+    return stream.getvalue()
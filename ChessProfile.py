@@ -0,0 +1,140 @@
+"""
+Instrumentation: named call counters and timers for the hot paths of the engine, off unless asked for.
+
+    CHESS_PROFILE=1 python ChessBench.py perft          table of every counter and timer on stderr at exit
+    CHESS_PROFILE=json python ChessBatch.py in.epd      the same as JSON on stderr
+    CHESS_PROFILE=stats.json python ChessMain.py        JSON written to that file at exit
+
+Functions are instrumented with the @profiled("name") decorator when their module is imported. With profiling off the
+decorator returns the function itself, so a disabled build runs exactly the code it would run without this module.
+With profiling on every call is counted and timed (times are inclusive, legal_moves includes the attack maps it computes).
+Names are grouped by prefix: movegen, attacks, board (make/unmake), hash, eval, ui.
+
+count(name) and timer(name) record events and sections that are not whole functions, callers in hot paths should
+check ENABLED first. Worker processes of ChessBatch and the parallel search keep their own numbers, only the main
+process reports.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+PROFILE_SETTING = os.environ.get("CHESS_PROFILE", "").strip()
+ENABLED = PROFILE_SETTING not in ("", "0")
+
+# name -> [calls, nanoseconds], and name -> count for plain counters
+_timers = defaultdict(lambda: [0, 0])
+_counters = defaultdict(int)
+
+
+def profiled(name):
+    """
+    Decorator counting and timing every call of a function under name, a no-op when profiling is off
+    """
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        stat = _timers[name]
+        clock = time.perf_counter_ns
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stat[0] += 1
+                stat[1] += clock() - start
+
+        return wrapper
+
+    return decorate
+
+
+def count(name, amount=1):
+    if ENABLED:
+        _counters[name] += amount
+
+
+class _Timer():
+    # Context manager adding the time of a with block to a timer
+    __slots__ = ("stat", "start")
+
+    def __init__(self, name):
+        self.stat = _timers[name]
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        self.stat[0] += 1
+        self.stat[1] += time.perf_counter_ns() - self.start
+
+
+class _NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """
+    Times a with block under name: with timer("ui.redraw"): ...
+    """
+    return _Timer(name) if ENABLED else _NULL_TIMER
+
+
+def summary():
+    """
+    Every timer as {"calls", "total_ms", "mean_us"} and every counter as its count, by name
+    """
+    result = {}
+    for name, (calls, nanoseconds) in sorted(_timers.items()):
+        if calls:
+            result[name] = {"calls": calls, "total_ms": round(nanoseconds / 1e6, 3), "mean_us": round(nanoseconds / calls / 1e3, 3)}
+    for name, value in sorted(_counters.items()):
+        result[name] = value
+
+    return result
+
+
+def format_table(stats):
+    lines = [f"{'name':<28} {'calls':>12} {'total ms':>12} {'mean us':>10}"]
+    for name, stat in stats.items():
+        if isinstance(stat, dict):
+            lines.append(f"{name:<28} {stat['calls']:>12} {stat['total_ms']:>12.3f} {stat['mean_us']:>10.3f}")
+        else:
+            lines.append(f"{name:<28} {stat:>12}")
+
+    return "\n".join(lines)
+
+
+def report():
+    # Writes the summary where CHESS_PROFILE asks for it, called at exit
+    stats = summary()
+    if not stats:
+        return
+
+    if PROFILE_SETTING.endswith(".json"):
+        with open(PROFILE_SETTING, "w") as stream:
+            json.dump(stats, stream, indent=2)
+    elif PROFILE_SETTING.lower() == "json":
+        sys.stderr.write(json.dumps(stats, indent=2) + "\n")
+    else:
+        sys.stderr.write(format_table(stats) + "\n")
+
+
+if ENABLED:
+    atexit.register(report)
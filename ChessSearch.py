@@ -0,0 +1,434 @@
+"""
+Alpha-beta search on top of GameState.
+
+best_move(position, depth=None, time_limit=None) runs a negamax alpha-beta search with iterative deepening and returns
+the best move found as an encoded move (see ChessEngine). Every completed iteration is reported with its depth, score,
+node count, nodes per second and principal variation.
+Results are kept in a transposition table (see ChessTransposition) so transposed positions are not searched again.
+Moves are played with GameState.make_move/unmake_move on the one game state, nothing is copied during the search.
+Moves are searched in the order given by ChessOrdering (hash move, captures, killer moves, history heuristic).
+At depth 0 a quiescence search keeps playing captures and promotions until the position is quiet, so the evaluation is
+never taken in the middle of an exchange (the horizon effect).
+
+With threads=N the search runs in N processes (Lazy SMP): every worker searches the same root with iterative
+deepening, half of them one iteration ahead, and they share one transposition table in shared memory, so each worker
+mostly finds positions already searched by the others and they reach a depth sooner together. The move of the deepest
+iteration completed by any worker is played.
+"""
+import multiprocessing
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+from queue import Empty
+
+from ChessEngine import GameState, MOVES_NOISY, MOVE_PROMOTION_SHIFT, FLAG_EN_PASSANT, QUEEN, W_PAWN, move_to_uci
+from ChessEval import evaluate
+from ChessOrdering import MoveOrderer, mvv_lva
+from ChessTransposition import TranspositionTable, BOUND_EXACT, BOUND_LOWER, BOUND_UPPER, DEFAULT_SIZE_MB
+
+# Scores are in centipawns from the side to move's point of view
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 128
+DEFAULT_DEPTH = 4
+
+# Material values for delta pruning, in the order of the piece indices (white, black)
+PIECE_VALUES = [100, 100, 500, 500, 320, 320, 330, 330, 900, 900, 0, 0]
+
+# A capture is skipped in the quiescence search if even winning the piece plus this margin cannot raise alpha
+DELTA_MARGIN = 200
+
+# Reported after every completed iteration
+SearchInfo = namedtuple("SearchInfo", ["depth", "score", "nodes", "nps", "time", "pv"])
+
+
+def score_to_table(score, ply):
+    # Mate scores are stored relative to the position instead of the root, so they stay right when reached from another path
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+def print_info(info):
+    # Default reporter, one line per completed iteration
+    print(f"depth {info.depth} score {info.score} nodes {info.nodes} nps {info.nps:.0f} time {info.time:.3f} pv {' '.join(move_to_uci(move) for move in info.pv)}")
+
+
+class Searcher():
+    """
+    Searches one game state, the state is left as it was found when the search returns
+    """
+
+    def __init__(self, game_state, info=print_info, table=None):
+        self.game_state = game_state
+        self.info = info # Called with a SearchInfo after every completed iteration, None to stay quiet
+        # The table can be shared between searches (moves of the same game), a new one is made if none is given
+        self.table = table if table is not None else TranspositionTable()
+        self.orderer = MoveOrderer(MAX_PLY)
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = None
+        self.stop_event = None # An Event (threading or multiprocessing) that ends the search when set
+        self.node_limit = None # The search stops once it has searched this many nodes
+        self.tablebases = None # Endgame Tablebases (see ChessTablebase), positions in them are not searched
+        # Triangular principal variation table, pv[ply] is the best line found from that ply
+        self.pv = [[] for _ in range(MAX_PLY + 1)]
+
+
+    def stop(self):
+        # Ends the search early, the last completed iteration is used
+        self.stopped = True
+
+
+    def check_time(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        if self.stop_event is not None and self.stop_event.is_set():
+            self.stopped = True
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            self.stopped = True
+
+
+    def search(self, depth=None, time_limit=None, start_depth=1):
+        """
+        Iterative deepening, searches depth start_depth, start_depth + 1, ... until depth is reached or time_limit (seconds) runs out
+        Returns (best move, score, principal variation), the best move is None if there are no legal moves
+        """
+        if depth is None:
+            depth = MAX_PLY if time_limit is not None else DEFAULT_DEPTH
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.stopped = False
+        self.nodes = 0
+        self.table.new_search()
+        self.orderer.new_search()
+
+        best_move, best_score, best_pv = None, 0, []
+        root_moves = self.game_state.legal_moves()
+        if not root_moves:
+            return None, 0, []
+
+        # A position in the tablebases has its best move without a search
+        if self.tablebases is not None:
+            found = self.tablebases.best_move(self.game_state)
+            if found is not None:
+                move, score = found
+                if self.info is not None:
+                    self.info(SearchInfo(1, score, 0, 0.0, time.perf_counter() - start, [move]))
+                return move, score, [move]
+
+        for iteration in range(min(start_depth, depth), depth + 1):
+            score = self.negamax(iteration, -INFINITY, INFINITY, 0, best_pv)
+
+            # An unfinished iteration is thrown away, unless nothing has been found yet
+            if self.stopped:
+                if best_move is None:
+                    best_pv = list(self.pv[0]) or [root_moves[0]]
+                    best_move, best_score = best_pv[0], score
+                break
+
+            best_pv = list(self.pv[0])
+            best_move, best_score = best_pv[0], score
+
+            elapsed = time.perf_counter() - start
+            if self.info is not None:
+                self.info(SearchInfo(iteration, score, self.nodes, self.nodes / elapsed if elapsed > 0 else 0.0, elapsed, best_pv))
+
+            # No need to search deeper once a forced mate has been found
+            if abs(score) >= MATE_SCORE - MAX_PLY:
+                break
+
+        return best_move, best_score, best_pv
+
+
+    def negamax(self, depth, alpha, beta, ply, pv_line):
+        """
+        Negamax alpha-beta, returns the score of the position for the side to move
+        pv_line is the principal variation of the previous iteration, its move is searched first while following it
+        """
+        game_state = self.game_state
+        self.nodes += 1
+        self.pv[ply] = []
+
+        # Check the clock every 1024 nodes
+        if self.nodes & 1023 == 0:
+            self.check_time()
+
+        # Repetitions and the fifty move rule are draws
+        if ply > 0 and (game_state.halfmove_clock >= 100 or game_state.repetition_count() > 1):
+            return 0
+
+        # Exact results for endings in the tablebases
+        if self.tablebases is not None and ply > 0 and game_state.occupied.bit_count() <= self.tablebases.max_pieces:
+            score = self.tablebases.probe_score(game_state, ply)
+            if score is not None:
+                return score
+
+        # A result from the transposition table that was searched at least as deep can end the search of this position,
+        # its move is searched first otherwise
+        table_move = 0
+        entry = self.table.probe(game_state.zobrist_key)
+        if entry is not None:
+            table_move, table_score, table_depth, bound = entry
+            if ply > 0 and table_depth >= depth:
+                table_score = score_from_table(table_score, ply)
+                if bound == BOUND_EXACT or (bound == BOUND_LOWER and table_score >= beta) or (bound == BOUND_UPPER and table_score <= alpha):
+                    if table_move:
+                        self.pv[ply] = [table_move]
+                    return table_score
+
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(alpha, beta, ply)
+
+        # Search the previous iteration's best move first, then the move from the transposition table
+        first_move = pv_line[0] if pv_line else table_move
+
+        alpha_start = alpha
+        best_score = -INFINITY
+        best_move = 0
+        index = -1
+        for index, move in enumerate(self.orderer.ordered_moves(game_state, ply, first_move)):
+            game_state.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1, pv_line[1:] if pv_line and move == pv_line[0] else None)
+            game_state.unmake_move()
+
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        self.orderer.cutoff(game_state, move, depth, ply, index)
+                        break
+
+        if index < 0:
+            # Checkmate (prefer the shortest mate) or stalemate
+            return -MATE_SCORE + ply if game_state.king_in_check(game_state.white_to_move) else 0
+
+        if best_score >= beta:
+            bound = BOUND_LOWER
+        elif best_score > alpha_start:
+            bound = BOUND_EXACT
+        else:
+            bound = BOUND_UPPER
+        self.table.store(game_state.zobrist_key, depth, score_to_table(best_score, ply), bound, best_move)
+
+        return best_score
+
+
+    def quiescence(self, alpha, beta, ply):
+        """
+        Searches only captures and promotions until the position is quiet, then evaluates it
+        The side to move can always stand pat (take the evaluation) instead of capturing, unless it is in check,
+        then every evasion is searched so mates are still found
+        Captures that lose material (see) or cannot raise alpha even if the piece is won for free (delta pruning) are skipped
+        """
+        game_state = self.game_state
+        self.nodes += 1
+        self.pv[ply] = []
+
+        if self.nodes & 1023 == 0:
+            self.check_time()
+
+        # The principal variation table ends at MAX_PLY, even a sequence of checks stops there
+        if ply >= MAX_PLY:
+            return evaluate(game_state)
+
+        in_check = game_state.king_in_check(game_state.white_to_move)
+        if in_check:
+            moves = game_state.legal_moves()
+            if not moves:
+                return -MATE_SCORE + ply
+            best_score = -INFINITY
+        else:
+            stand_pat = evaluate(game_state)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            best_score = stand_pat
+            moves = game_state.legal_moves(MOVES_NOISY)
+
+        squares = game_state.squares
+        moves.sort(key=lambda move: mvv_lva(squares, move), reverse=True)
+
+        for move in moves:
+            if not in_check:
+                promotion = move >> MOVE_PROMOTION_SHIFT & 7
+                if promotion:
+                    # Under-promotions are left to the full search
+                    if promotion != QUEEN:
+                        continue
+                else:
+                    captured = W_PAWN if move & FLAG_EN_PASSANT else squares[move >> 6 & 63]
+                    if stand_pat + PIECE_VALUES[captured] + DELTA_MARGIN <= alpha:
+                        continue
+                if game_state.see(move) < 0:
+                    continue
+
+            game_state.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            game_state.unmake_move()
+
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        break
+
+        return best_score
+
+
+# State of a parallel search worker process, set up once by _init_worker
+_worker_table = None
+_worker_memory = None
+_worker_stop = None
+_worker_results = None
+
+
+def _init_worker(memory_name, size_mb, stop_event, results):
+    # Attaches the worker process to the shared transposition table
+    global _worker_table, _worker_memory, _worker_stop, _worker_results
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    _worker_table = TranspositionTable(size_mb, buffer=_worker_memory.buf)
+    _worker_stop = stop_event
+    _worker_results = results
+
+
+def _worker_search(task):
+    """
+    Runs one worker's search, every completed iteration is sent to the main process as (search id, worker, SearchInfo)
+    The first worker to finish stops all the others
+    Returns (best move, score, principal variation, nodes)
+    """
+    search_id, worker, game_state, depth, time_limit = task
+    searcher = Searcher(game_state, info=lambda info: _worker_results.put((search_id, worker, info)), table=_worker_table)
+    searcher.stop_event = _worker_stop
+    # Odd workers search one iteration ahead, so the workers do not all search the same depth at the same time
+    move, score, pv = searcher.search(depth, time_limit, start_depth=1 + worker % 2)
+    _worker_stop.set()
+
+    return move, score, pv, searcher.nodes
+
+
+class ParallelSearcher():
+    """
+    Lazy SMP search over a pool of worker processes sharing one transposition table
+    The pool and the table are kept between searches, close() releases them
+    """
+
+    def __init__(self, threads, size_mb=DEFAULT_SIZE_MB, info=print_info):
+        self.threads = threads
+        self.info = info
+        self.nodes = 0
+        self.search_id = 0 # Tags the iterations sent by the workers, late ones from an earlier search are dropped
+        self.memory = shared_memory.SharedMemory(create=True, size=TranspositionTable.buffer_size(size_mb))
+        self.stop_event = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        self.pool = multiprocessing.Pool(threads, initializer=_init_worker, initargs=(self.memory.name, size_mb, self.stop_event, self.results))
+
+
+    def search(self, game_state, depth=None, time_limit=None):
+        """
+        Searches the game state with every worker, returns (best move, score, principal variation) of the deepest
+        iteration any worker completed
+        """
+        legal_moves = game_state.legal_moves()
+        if not legal_moves:
+            return None, 0, []
+
+        # The game state is pickled with its key history (see GameState.__getstate__), so repetitions are still seen
+        self.search_id += 1
+        tasks = [(self.search_id, worker, game_state, depth, time_limit) for worker in range(self.threads)]
+        start = time.perf_counter()
+        self.stop_event.clear()
+        pending = self.pool.map_async(_worker_search, tasks)
+
+        best = None
+        while True:
+            try:
+                search_id, worker, info = self.results.get(timeout=0.01)
+            except Empty:
+                if pending.ready():
+                    break
+                continue
+
+            if search_id != self.search_id:
+                continue
+            if best is None or info.depth > best.depth:
+                best = info
+                if self.info is not None:
+                    elapsed = time.perf_counter() - start
+                    self.info(info._replace(time=elapsed))
+
+        finished = pending.get()
+        self.nodes = sum(nodes for move, score, pv, nodes in finished)
+
+        # If no iteration was completed, the first worker's result is used
+        if best is None or best.pv[0] not in legal_moves:
+            return finished[0][:3]
+
+        return best.pv[0], best.score, best.pv
+
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.memory.close()
+        self.memory.unlink()
+
+
+def best_move(position, depth=None, time_limit=None, info=print_info, table=None, threads=1, book=None, tablebases=None):
+    """
+    Returns the best move for the side to move as an encoded move (None if there are no legal moves)
+    position is a GameState or a FEN string, with no depth or time_limit the search goes to DEFAULT_DEPTH
+    threads > 1 searches in that many processes with a shared transposition table (table is not used then)
+    book is an OpeningBook (see ChessBook), a book move is played without searching
+    tablebases are endgame Tablebases (see ChessTablebase), probed at the root and in the search
+    """
+    if isinstance(position, str):
+        game_state = GameState.from_fen(position)
+    else:
+        game_state = position
+
+    if book is not None:
+        move = book.choose(game_state)
+        if move is not None:
+            return move
+
+    if tablebases is not None:
+        found = tablebases.best_move(game_state)
+        if found is not None:
+            return found[0]
+
+    if threads > 1:
+        searcher = ParallelSearcher(threads, info=info)
+        try:
+            move, score, pv = searcher.search(game_state, depth, time_limit)
+        finally:
+            searcher.close()
+        return move
+
+    searcher = Searcher(game_state, info, table)
+    searcher.tablebases = tablebases
+    move, score, pv = searcher.search(depth, time_limit)
+    return move
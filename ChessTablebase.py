@@ -0,0 +1,613 @@
+"""
+Endgame tablebases for 3 and 4 piece endings (KQK, KRK, KPK, KQKR, KRKP, ...), generated offline by retrograde analysis.
+
+    python ChessTablebase.py                            every 3 piece table, in ./tablebases
+    python ChessTablebase.py KQKR KRKP KPKP             these tables, and the smaller ones they convert into
+
+A table holds, for every position of its material with either side to move, whether the side to move wins, draws or
+loses and in how many plies the game is mated with perfect play (distance to mate). Generation starts from the mates
+and works backwards a ply at a time: a position is won if a move reaches a position lost for the opponent, lost if
+every move reaches a position won for the opponent. Captures and promotions leave the table and are looked up in the
+table of the material they lead to, so KQKR needs KQK and KRK (the rook takes the queen) and those are generated first.
+The steps are NumPy operations on arrays with an axis of 64 squares per piece, KQKR takes a few minutes.
+
+Files are named after their material (KQKR.ctb, the stronger side first as white) and hold one byte per position:
+    0 draw, an odd v a win in v plies, an even v >= 2 a loss in v - 2 plies, 255 not a legal position
+after a header, first the positions with white to move then black to move, indexed by the square of every piece in the
+order of the name. The white king is kept on 10 squares (a1-d1-d4) by the symmetries of the board, on the a-d files for
+tables with pawns. Tables are memory-mapped at probe time, a probe reads one byte.
+
+    tablebases = Tablebases("tablebases")
+    tablebases.probe(game_state)          # the byte above, None if the position is not in a table
+    tablebases.best_move(game_state)      # (move, score) of the best move, None if the position is not in a table
+
+Positions with castling rights or an en passant square are not in the tables, and the fifty move rule is not taken
+into account (a few 4 piece wins take longer than 50 moves without a capture or pawn move).
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from ChessEngine import PAWN, ROOK, KNIGHT, BISHOP, QUEEN, KING, KNIGHT_ATTACKS, KING_ATTACKS
+from ChessSearch import MATE_SCORE, MAX_PLY
+
+MAX_PIECES = 4
+TABLE_EXTENSION = ".ctb"
+MAGIC = b"CTB1"
+HEADER = struct.Struct(">4s8sB3x") # Magic, material name, number of pieces
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+DEFAULT_TABLES = ["KQK", "KRK", "KBK", "KNK", "KPK"]
+
+DRAW = 0
+INVALID = 255
+UNREACHED = 32767 # Conversion levels of positions without such a conversion
+
+# Letters of the piece types (pawn, rook, knight, bishop, queen, king), and the order of the pieces of a side in a name
+PIECE_LETTERS = "PRNBQK"
+SIDE_ORDER = "KQRBNP"
+
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def _transform(square, symmetry):
+    # Square under one of the 8 symmetries of the board: bit 0 mirrors the files, bit 1 the ranks, bit 2 the diagonal
+    rank, file = divmod(square, 8)
+    if symmetry & 1:
+        file = 7 - file
+    if symmetry & 2:
+        rank = 7 - rank
+    if symmetry & 4:
+        rank, file = file, rank
+    return rank * 8 + file
+
+
+def _king_squares(pawns):
+    # Squares the white king is stored on: a1-d1-d4 without pawns, the a-d files with them
+    if pawns:
+        return [square for square in range(64) if square & 7 <= 3]
+    return [square for square in range(64) if square & 7 <= 3 and square >> 3 >= 4 and (square & 7) + (square >> 3) >= 7]
+
+
+TRANSFORMS = [[_transform(square, symmetry) for square in range(64)] for symmetry in range(8)]
+KING_SQUARES = [_king_squares(False), _king_squares(True)]
+# Index of each stored king square, and the symmetry that takes every square to a stored one (by pawns / no pawns)
+KING_SLOTS = [{square: slot for slot, square in enumerate(squares)} for squares in KING_SQUARES]
+KING_SYMMETRY = [[next(symmetry for symmetry in range(8 if not pawns else 2) if TRANSFORMS[symmetry][square] in KING_SLOTS[pawns])
+                  for square in range(64)] for pawns in (0, 1)]
+FLIP = [square ^ 56 for square in range(64)] # Mirrors the ranks, for swapping the colors
+
+
+def parse_material(name):
+    """
+    Pieces of a material name like "KQKR" as a list of (color, piece type), white (0) first, kings first
+    """
+    name = name.upper()
+    black_start = name.find("K", 1)
+    if not name.startswith("K") or black_start < 0 or any(letter not in PIECE_LETTERS for letter in name):
+        raise ValueError("not a material name: " + name)
+
+    pieces = []
+    for color, letters in enumerate((name[:black_start], name[black_start:])):
+        if letters.count("K") != 1:
+            raise ValueError("not a material name: " + name)
+        pieces += [(color, PIECE_LETTERS.index(letter)) for letter in sorted(letters, key=SIDE_ORDER.index)]
+    return pieces
+
+
+def material_name(pieces):
+    # Name of a list of (color, piece type), the inverse of parse_material
+    sides = ["".join(PIECE_LETTERS[piece_type] for piece_color, piece_type in pieces if piece_color == color) for color in (0, 1)]
+    return "".join("".join(sorted(letters, key=SIDE_ORDER.index)) for letters in sides)
+
+
+def _side_strength(pieces, color):
+    # Sides are compared by their number of pieces, then piece by piece (queen > rook > bishop > knight > pawn)
+    order = sorted(SIDE_ORDER.index(PIECE_LETTERS[piece_type]) for piece_color, piece_type in pieces if piece_color == color)
+    return len(order), [-index for index in order]
+
+
+def canonical(pieces):
+    """
+    Name of the table holding a material, and whether the colors have to be swapped to find it there
+    """
+    if _side_strength(pieces, 0) >= _side_strength(pieces, 1):
+        return material_name(pieces), False
+    return material_name([(1 - color, piece_type) for color, piece_type in pieces]), True
+
+
+def _slides(square, directions):
+    # (target, squares in between) of every move along the directions from square
+    rank, file = divmod(square, 8)
+    moves = []
+    for i, j in directions:
+        between = ()
+        r, f = rank + i, file + j
+        while 0 <= r < 8 and 0 <= f < 8:
+            moves.append((r * 8 + f, between))
+            between += (r * 8 + f,)
+            r, f = r + i, f + j
+    return moves
+
+
+def _bits(bitboard):
+    return [square for square in range(64) if bitboard >> square & 1]
+
+
+def _piece_moves(piece_type, square):
+    # (target, squares in between) of every move of a piece other than a pawn on an empty board
+    if piece_type == KNIGHT:
+        return [(target, ()) for target in _bits(KNIGHT_ATTACKS[square])]
+    if piece_type == KING:
+        return [(target, ()) for target in _bits(KING_ATTACKS[square])]
+    if piece_type == ROOK:
+        return _slides(square, ROOK_DIRECTIONS)
+    if piece_type == BISHOP:
+        return _slides(square, BISHOP_DIRECTIONS)
+    return _slides(square, ROOK_DIRECTIONS + BISHOP_DIRECTIONS)
+
+
+def _pawn_pushes(color, square):
+    # (target, squares in between) of the moves forward of a pawn, white pawns go towards rank index 0
+    rank, file = divmod(square, 8)
+    step = -1 if color == 0 else 1
+    if not 0 <= rank + step < 8:
+        return []
+    pushes = [((rank + step) * 8 + file, ())]
+    if rank == (6 if color == 0 else 1):
+        pushes.append(((rank + 2 * step) * 8 + file, ((rank + step) * 8 + file,)))
+    return pushes
+
+
+def _pawn_captures(color, square):
+    rank, file = divmod(square, 8)
+    step = -1 if color == 0 else 1
+    if not 0 <= rank + step < 8:
+        return []
+    return [(rank + step) * 8 + file + j for j in (-1, 1) if 0 <= file + j < 8]
+
+
+def _last_rank(color, square):
+    return square >> 3 == (0 if color == 0 else 7)
+
+
+def _attacks(piece_type, color, square):
+    # (target, squares in between) of the squares a piece attacks
+    if piece_type == PAWN:
+        return [(target, ()) for target in _pawn_captures(color, square)]
+    return _piece_moves(piece_type, square)
+
+
+def _clear_between(array, between):
+    # Clears the entries of the array where any of its pieces (axes) stands on a square in between
+    for axis in range(array.ndim):
+        np.moveaxis(array, axis, 0)[list(between)] = False
+
+
+class TableGenerator():
+    """
+    Generates tables by retrograde analysis, and keeps the full arrays of the tables it has made or loaded to look
+    up captures and promotions
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, log=None):
+        self.directory = directory
+        self.log = log # Called with a line of text about every table generated, None to stay quiet
+        self.tables = {} # Material name -> (white to move, black to move) arrays with an axis of 64 squares per piece
+
+
+    def table(self, name):
+        """
+        Full arrays of a table, read from its file or generated (and written) if there is none
+        """
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + TABLE_EXTENSION)
+            if os.path.exists(path):
+                self.tables[name] = read_table(path)
+            else:
+                self.tables[name] = self.generate(name)
+                write_table(path, name, self.tables[name])
+        return self.tables[name]
+
+
+    def values(self, pieces, color):
+        """
+        Array of the values of a material (pieces in any order and with either color stronger) with color to move,
+        with an axis per piece in the order given
+        """
+        if len(pieces) == 2:
+            # Two kings are always a draw
+            kings = np.zeros((64, 64), np.uint8)
+            kings[np.eye(64, dtype=bool) | KINGS_NEAR] = INVALID
+            return kings
+
+        name, flipped = canonical(pieces)
+        if flipped:
+            pieces = [(1 - piece_color, piece_type) for piece_color, piece_type in pieces]
+            color = 1 - color
+        table_pieces = parse_material(name)
+
+        # Axis of the table for each piece, identical pieces are matched in turn
+        axes = []
+        for piece in pieces:
+            axes.append(next(axis for axis, table_piece in enumerate(table_pieces) if table_piece == piece and axis not in axes))
+        array = self.table(name)[color].transpose(axes)
+        if flipped:
+            array = array[np.ix_(*[FLIP] * len(pieces))]
+        return array
+
+
+    def generate(self, name):
+        """
+        Retrograde analysis of one material, returns the (white to move, black to move) arrays of values
+        """
+        start = time.perf_counter()
+        pieces = parse_material(name)
+        count = len(pieces)
+        if not 3 <= count <= MAX_PIECES:
+            raise ValueError(f"tables have 3 to {MAX_PIECES} pieces: {name}")
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        shape = (64,) * count
+        squares = [np.arange(64).reshape([64 if axis == i else 1 for axis in range(count)]) for i in range(count)]
+        kings = [pieces.index((0, KING)), pieces.index((1, KING))]
+
+        # Pieces on different squares, kings apart, no pawns on the first or last rank
+        board = np.ones(shape, bool)
+        for i in range(count):
+            for j in range(i + 1, count):
+                board &= squares[i] != squares[j]
+            if pieces[i][1] == PAWN:
+                board &= (squares[i] >> 3 != 0) & (squares[i] >> 3 != 7)
+        board &= ~KINGS_NEAR[squares[kings[0]], squares[kings[1]]]
+
+        in_check = [self._attacked(pieces, color) & board for color in (0, 1)]
+        # A position is legal if the side that has just moved is not in check
+        valid = [board & ~in_check[1], board & ~in_check[0]]
+
+        # Best (lowest) win and the longest resistance through a capture or promotion, in plies
+        wins, escapes = [], []
+        for color in (0, 1):
+            win, escape = self._conversions(pieces, color)
+            wins.append(win)
+            escapes.append(escape)
+        last_conversion = max([int(array[(array != UNREACHED) & (array >= 0)].max(initial=0)) for array in wins + escapes])
+
+        values = [np.where(valid[color], DRAW, INVALID).astype(np.uint8) for color in (0, 1)]
+        unresolved = [valid[color].copy() for color in (0, 1)]
+        won = [np.zeros(shape, bool), np.zeros(shape, bool)]
+        lost = []
+        # Positions without legal moves: checkmate is a loss in 0 plies, stalemate a draw
+        for color in (0, 1):
+            stuck = valid[color] & ~self._can_move_into(pieces, color, valid[1 - color]) & (escapes[color] < 0)
+            lost.append(stuck & in_check[color])
+            values[color][lost[color]] = 2
+            unresolved[color] &= ~stuck
+
+        ply = 0
+        idle = 0
+        while idle < 2 or ply <= last_conversion:
+            ply += 1
+            if ply >= INVALID - 2:
+                raise ValueError(f"{name}: distance to mate too long for the table format")
+            found = False
+            if ply & 1:
+                # Won if a move reaches a position the opponent lost in ply - 1
+                for color in (0, 1):
+                    new = unresolved[color] & (self._can_move_into(pieces, color, lost[1 - color]) | (wins[color] == ply))
+                    values[color][new] = ply
+                    unresolved[color] &= ~new
+                    won[color] |= new
+                    found = found or bool(new.any())
+            else:
+                # Lost if no move reaches a position the opponent has not won yet
+                lost = []
+                for color in (0, 1):
+                    escape = self._can_move_into(pieces, color, valid[1 - color] & ~won[1 - color]) | (escapes[color] >= ply)
+                    new = unresolved[color] & ~escape
+                    values[color][new] = ply + 2
+                    unresolved[color] &= ~new
+                    lost.append(new)
+                    found = found or bool(new.any())
+            idle = 0 if found else idle + 1
+
+        if self.log is not None:
+            wins_count = sum(int(np.count_nonzero(valid[color] & (values[color] & 1 == 1))) for color in (0, 1))
+            draws = sum(int(np.count_nonzero(valid[color] & (values[color] == DRAW))) for color in (0, 1))
+            longest = max(int(values[color][valid[color] & (values[color] & 1 == 1)].max(initial=0)) for color in (0, 1))
+            self.log(f"{name}: {wins_count} won, {draws} drawn, longest win {longest} plies, {time.perf_counter() - start:.1f} s")
+        return values[0], values[1]
+
+
+    def _attacked(self, pieces, color):
+        # Positions where the king of color is attacked by a piece of the other color
+        count = len(pieces)
+        king = pieces.index((color, KING))
+        attacked = np.zeros((64,) * count, bool)
+        for i, (piece_color, piece_type) in enumerate(pieces):
+            if piece_color == color or piece_type == KING:
+                continue
+            view = np.moveaxis(attacked, (i, king), (0, 1))
+            for square in range(64):
+                for target, between in _attacks(piece_type, piece_color, square):
+                    if between:
+                        free = np.ones((64,) * (count - 2), bool)
+                        _clear_between(free, between)
+                        view[square, target] |= free
+                    else:
+                        view[square, target] = True
+        return attacked
+
+
+    def _can_move_into(self, pieces, color, targets):
+        """
+        Positions with color to move that have a move (not a capture or promotion) to one of the target positions
+        """
+        result = np.zeros(targets.shape, bool)
+        for i, (piece_color, piece_type) in enumerate(pieces):
+            if piece_color != color:
+                continue
+            result_view = np.moveaxis(result, i, 0)
+            target_view = np.moveaxis(targets, i, 0)
+            for square in range(64):
+                if piece_type == PAWN:
+                    moves = [(target, between) for target, between in _pawn_pushes(color, square) if not _last_rank(color, target)]
+                else:
+                    moves = _piece_moves(piece_type, square)
+                for target, between in moves:
+                    if between:
+                        reached = target_view[target].copy()
+                        _clear_between(reached, between)
+                        result_view[square] |= reached
+                    else:
+                        result_view[square] |= target_view[target]
+        return result
+
+
+    def _conversions(self, pieces, color):
+        """
+        Captures and promotions of color, looked up in the tables they lead to. Returns two arrays of plies:
+        the fastest win through one (UNREACHED if none wins) and the longest the opponent needs to win after one
+        (UNREACHED if one does not lose, -1 if there is none)
+        """
+        count = len(pieces)
+        win = np.full((64,) * count, UNREACHED, np.int16)
+        escape = np.full((64,) * count, -1, np.int16)
+
+        for i, (piece_color, piece_type) in enumerate(pieces):
+            if piece_color != color:
+                continue
+            for square in range(64):
+                if piece_type == PAWN:
+                    captures = [(target, ()) for target in _pawn_captures(color, square)]
+                    pushes = [(target, ()) for target, between in _pawn_pushes(color, square) if _last_rank(color, target)]
+                else:
+                    captures = _piece_moves(piece_type, square)
+                    pushes = []
+
+                for target, between in captures:
+                    promotions = [QUEEN, ROOK, BISHOP, KNIGHT] if piece_type == PAWN and _last_rank(color, target) else [piece_type]
+                    for j, (captured_color, captured_type) in enumerate(pieces):
+                        if captured_color == color or captured_type == KING:
+                            continue
+                        for promotion in promotions:
+                            after = [piece for k, piece in enumerate(pieces) if k != j]
+                            moved = i - (j < i)
+                            after[moved] = (color, promotion)
+                            reached = np.moveaxis(self.values(after, 1 - color), moved, 0)[target]
+                            self._update(np.moveaxis(win, (i, j), (0, 1))[square, target],
+                                         np.moveaxis(escape, (i, j), (0, 1))[square, target], reached, between)
+
+                for target, between in pushes:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        after = list(pieces)
+                        after[i] = (color, promotion)
+                        reached = np.moveaxis(self.values(after, 1 - color), i, 0)[target]
+                        self._update(np.moveaxis(win, i, 0)[square], np.moveaxis(escape, i, 0)[square], reached, between)
+
+        return win, escape
+
+
+    def _update(self, win, escape, reached, between):
+        # Adds the positions reached by one capture or promotion (values for the opponent to move) to the views
+        legal = reached != INVALID
+        if between:
+            _clear_between(legal, between)
+        reached = reached.astype(np.int16)
+        # The opponent lost in v - 2 plies: won in v - 1. The opponent won in v plies: lost in v + 1 at the most
+        np.minimum(win, np.where(legal & (reached > 0) & (reached & 1 == 0), reached - 1, UNREACHED), out=win)
+        np.maximum(escape, np.where(legal, np.where(reached & 1 == 1, reached, UNREACHED), -1), out=escape)
+
+
+KINGS_NEAR = np.array([[KING_ATTACKS[a] >> b & 1 == 1 for b in range(64)] for a in range(64)])
+
+
+def write_table(path, name, values):
+    """
+    Writes the full arrays of a table in the indexed format, keeping only the stored white king squares
+    """
+    pawns = "P" in name
+    with open(path + ".tmp", "wb") as stream:
+        stream.write(HEADER.pack(MAGIC, name.encode(), len(name)))
+        for array in values:
+            stream.write(np.ascontiguousarray(array[KING_SQUARES[pawns]]).tobytes())
+    # A table is only ever seen complete
+    os.replace(path + ".tmp", path)
+
+
+def read_table(path):
+    """
+    Full (white to move, black to move) arrays of a table file, the other white king squares filled in by symmetry
+    """
+    with open(path, "rb") as stream:
+        data = stream.read()
+    magic, name, count = HEADER.unpack_from(data)
+    name = name.rstrip(b"\0").decode()
+    pawns = "P" in name
+    stored = np.frombuffer(data, np.uint8, offset=HEADER.size).reshape((2, len(KING_SQUARES[pawns])) + (64,) * (count - 1))
+
+    values = []
+    for block in stored:
+        array = np.empty((64,) * count, np.uint8)
+        for square in range(64):
+            transform = TRANSFORMS[KING_SYMMETRY[pawns][square]]
+            array[square] = block[KING_SLOTS[pawns][transform[square]]][np.ix_(*[transform] * (count - 1))]
+        values.append(array)
+    return values[0], values[1]
+
+
+class Table():
+    """
+    One table file, memory-mapped for probing
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, self.count = HEADER.unpack_from(self.memory)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("not a tablebase file: " + path)
+        self.name = name.rstrip(b"\0").decode()
+        self.pieces = parse_material(self.name)
+        self.pawns = "P" in self.name
+        self.block_size = len(KING_SQUARES[self.pawns]) * 64 ** (self.count - 1)
+
+
+    def close(self):
+        self.memory.close()
+        self.file.close()
+
+
+    def value(self, squares, color):
+        # Byte of the position with the pieces on squares (in the order of the name) and color to move
+        transform = TRANSFORMS[KING_SYMMETRY[self.pawns][squares[0]]]
+        index = KING_SLOTS[self.pawns][transform[squares[0]]]
+        for square in squares[1:]:
+            index = index * 64 + transform[square]
+        return self.memory[HEADER.size + color * self.block_size + index]
+
+
+class Tablebases():
+    """
+    The tables of a directory, each memory-mapped the first time a position of its material is probed
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.tables = {} # Material name -> Table, None if there is no file for it
+        names = [name[:-len(TABLE_EXTENSION)] for name in os.listdir(directory) if name.endswith(TABLE_EXTENSION)] if os.path.isdir(directory) else []
+        # Positions with more pieces than the largest table are not probed
+        self.max_pieces = max([len(name) for name in names], default=2)
+
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+
+    def _table(self, name):
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + TABLE_EXTENSION)
+            self.tables[name] = Table(path) if os.path.exists(path) else None
+        return self.tables[name]
+
+
+    def probe(self, game_state):
+        """
+        Value of the position for the side to move (DRAW, an odd number of plies to a win, or 2 + the plies to a loss),
+        None if there is no table for it
+        """
+        if game_state.occupied.bit_count() > self.max_pieces or game_state.can_castle or game_state.en_passant is not None:
+            return None
+        if game_state.occupied.bit_count() == 2:
+            return DRAW
+
+        pieces = []
+        for piece in range(12):
+            bitboard = game_state.bitboards[piece]
+            while bitboard:
+                bit = bitboard & -bitboard
+                pieces.append((piece & 1, piece >> 1, bit.bit_length() - 1))
+                bitboard ^= bit
+        color = 0 if game_state.white_to_move else 1
+
+        name, flipped = canonical([(piece_color, piece_type) for piece_color, piece_type, square in pieces])
+        table = self._table(name)
+        if table is None:
+            return None
+        if flipped:
+            pieces = [(1 - piece_color, piece_type, FLIP[square]) for piece_color, piece_type, square in pieces]
+            color = 1 - color
+
+        # Squares in the order of the table's pieces
+        squares = []
+        for table_piece in table.pieces:
+            index = next(index for index, piece in enumerate(pieces) if piece[:2] == table_piece)
+            squares.append(pieces.pop(index)[2])
+        value = table.value(squares, color)
+        return None if value == INVALID else value
+
+
+    def probe_score(self, game_state, ply=0):
+        """
+        Search score of the position for the side to move, a mate score for wins and losses, None if it is not in a table
+        """
+        value = self.probe(game_state)
+        if value is None:
+            return None
+        if value == DRAW:
+            return 0
+        # The mate is kept inside the range searches treat as mate scores
+        if value & 1:
+            return MATE_SCORE - min(ply + value, MAX_PLY - 1)
+        return -MATE_SCORE + min(ply + value - 2, MAX_PLY - 1)
+
+
+    def best_move(self, game_state):
+        """
+        (move, score) of the move that wins fastest, draws, or loses slowest, None if the position is not in a table
+        """
+        if self.probe(game_state) is None:
+            return None
+
+        best, best_score = None, None
+        for move in game_state.legal_moves():
+            game_state.make_move(move)
+            score = self.probe_score(game_state, 1)
+            game_state.unmake_move()
+            if score is None:
+                return None
+            if best is None or -score > best_score:
+                best, best_score = move, -score
+        return None if best is None else (best, best_score)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases")
+    parser.add_argument("tables", nargs="*", default=DEFAULT_TABLES, help="material names like KQK or KRKP, every 3 piece table by default")
+    parser.add_argument("--directory", default=DEFAULT_DIRECTORY, help="directory of the table files")
+    args = parser.parse_args(argv)
+
+    generator = TableGenerator(args.directory, log=print)
+    for name in args.tables:
+        try:
+            pieces = parse_material(name)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+        generator.table(canonical(pieces)[0])
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
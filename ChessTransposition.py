@@ -0,0 +1,163 @@
+"""
+Fixed-size transposition table for the search.
+
+Entries live in one flat buffer of 64-bit words instead of a dict of objects, so the memory used is set up front in MB
+and never grows. The buffer can be any writable buffer (a bytearray by default, shared memory for several processes).
+
+Every entry is 2 words: the position's Zobrist key XORed with the data word, and the data word
+    bits  0-17  best move (encoded move, 0 if none)
+    bits 18-37  score + SCORE_BIAS
+    bits 38-45  depth + DEPTH_BIAS
+    bits 46-47  bound type
+    bits 48-55  age (search number the entry was written in)
+XORing the key with the data means a half-written entry never matches a key, which keeps sharing the table lock free.
+
+Entries are grouped in buckets of 2: the first slot keeps the deepest result (it is only replaced by an equal or
+deeper search, or by any search once it is from an older search), the second slot is always replaced.
+"""
+from ChessProfile import profiled
+
+# Bound types, empty slots have bound 0
+BOUND_EXACT = 1
+BOUND_LOWER = 2 # The score is at least this (the search failed high)
+BOUND_UPPER = 3 # The score is at most this (the search failed low)
+
+ENTRY_WORDS = 2
+BUCKET_ENTRIES = 2
+BUCKET_BYTES = ENTRY_WORDS * BUCKET_ENTRIES * 8
+SCORE_BIAS = 1 << 19
+DEPTH_BIAS = 16
+DEFAULT_SIZE_MB = 16
+
+
+def _bucket_count(size_mb):
+    # Largest power of 2 number of buckets that fits in size_mb
+    buckets = 1
+    while buckets * 2 * BUCKET_BYTES <= size_mb * 1024 * 1024:
+        buckets *= 2
+
+    return buckets
+
+
+class TranspositionTable():
+
+    def __init__(self, size_mb=DEFAULT_SIZE_MB, buffer=None):
+        """
+        size_mb is rounded down to a power of 2 number of buckets
+        buffer can be passed to use existing memory (it has to be at least buffer_size(size_mb) bytes and zeroed)
+        """
+        buckets = _bucket_count(size_mb)
+        self.buckets = buckets
+        self.mask = buckets - 1
+        self.buffer = bytearray(buckets * BUCKET_BYTES) if buffer is None else buffer
+        self.words = memoryview(self.buffer).cast("B")[:buckets * BUCKET_BYTES].cast("Q")
+        self.age = 0
+
+        # Statistics since the last new_search()
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0 # Stores that replaced an entry of another position
+
+
+    @staticmethod
+    def buffer_size(size_mb):
+        # Bytes of buffer a table of size_mb uses
+        return _bucket_count(size_mb) * BUCKET_BYTES
+
+
+    def new_search(self):
+        """
+        Starts a new search, entries from older searches become replaceable and the statistics are reset
+        """
+        self.age = (self.age + 1) & 0xFF
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+
+    def clear(self):
+        memory = memoryview(self.buffer).cast("B")
+        memory[:] = bytes(len(memory))
+        self.age = 0
+
+
+    @profiled("hash.table_probe")
+    def probe(self, key):
+        """
+        Returns (move, score, depth, bound) stored for the position key, or None
+        """
+        self.probes += 1
+        words = self.words
+        index = (key & self.mask) * (ENTRY_WORDS * BUCKET_ENTRIES)
+
+        for slot in (index, index + ENTRY_WORDS):
+            data = words[slot + 1]
+            if data and words[slot] ^ data == key:
+                self.hits += 1
+                return (data & 0x3FFFF,
+                        (data >> 18 & 0xFFFFF) - SCORE_BIAS,
+                        (data >> 38 & 0xFF) - DEPTH_BIAS,
+                        data >> 46 & 3)
+
+        return None
+
+
+    @profiled("hash.table_store")
+    def store(self, key, depth, score, bound, move):
+        """
+        Stores a search result for the position key using the bucket's replacement policy
+        """
+        self.stores += 1
+        words = self.words
+        index = (key & self.mask) * (ENTRY_WORDS * BUCKET_ENTRIES)
+
+        # The depth-preferred slot is used if it is empty, holds this position, is from an older search, or is not deeper
+        data = words[index + 1]
+        old_key = words[index] ^ data
+        if data and old_key != key and (data >> 48) == self.age and (data >> 38 & 0xFF) - DEPTH_BIAS > depth:
+            # Otherwise the always-replace slot is used
+            index += ENTRY_WORDS
+            data = words[index + 1]
+            old_key = words[index] ^ data
+
+        if data:
+            if old_key != key:
+                self.overwrites += 1
+            # Keep the best move already known for the position if this result does not have one
+            elif not move:
+                move = data & 0x3FFFF
+
+        data = move | (score + SCORE_BIAS) << 18 | (depth + DEPTH_BIAS) << 38 | bound << 46 | self.age << 48
+        words[index] = key ^ data
+        words[index + 1] = data
+
+
+    def hashfull(self):
+        """
+        Permille of the first 1000 slots used by the current search
+        """
+        words = self.words
+        used = 0
+        buckets = min(self.buckets, 500)
+        for word in range(1, buckets * ENTRY_WORDS * BUCKET_ENTRIES, ENTRY_WORDS):
+            if words[word] and words[word] >> 48 == self.age:
+                used += 1
+
+        return used * 1000 // (buckets * BUCKET_ENTRIES)
+
+
+    def stats(self):
+        """
+        Probe, hit and overwrite counts of the current search, to tune the table size
+        """
+        return {
+            "size_mb": self.buckets * BUCKET_BYTES / (1024 * 1024),
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.probes if self.probes else 0.0,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+            "hashfull": self.hashfull(),
+        }
@@ -0,0 +1,313 @@
+"""
+UCI (Universal Chess Interface) front-end, so the engine can be used by chess GUIs and tournament managers.
+
+    python ChessUCI.py
+
+Commands are read from stdin by a reader thread and handled by the main thread, searches run in their own thread.
+That way stop, isready and ponderhit are answered while a search is running. Supported commands:
+    uci, isready, ucinewgame, setoption name Hash value <MB>, setoption name BookFile value <file.bin>,
+    setoption name TablebasePath value <directory>, quit
+    position startpos|fen <fen> [moves <move> ...]
+    go [depth N] [nodes N] [movetime MS] [wtime MS] [btime MS] [winc MS] [binc MS] [movestogo N] [infinite] [ponder]
+    stop, ponderhit
+Every completed iteration of a search is sent as an info line, then the best move.
+"""
+import os
+import queue
+import sys
+import threading
+import time
+
+from ChessBook import OpeningBook
+from ChessEngine import GameState, move_to_uci
+from ChessSearch import Searcher, MATE_SCORE, MAX_PLY
+from ChessTablebase import Tablebases
+from ChessTransposition import TranspositionTable, DEFAULT_SIZE_MB
+
+ENGINE_NAME = "Chess_V2"
+ENGINE_AUTHOR = "QQwertty"
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+MAX_HASH_MB = 1024
+MOVES_TO_GO = 30 # Moves the remaining time is shared between when the GUI does not say
+MOVE_OVERHEAD = 0.05 # Seconds kept back from every move for the communication with the GUI
+
+# stdout is written by the main thread and the search thread
+_output_lock = threading.Lock()
+
+
+def send(line):
+    with _output_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def parse_uci_move(game_state, text):
+    """
+    Returns the encoded legal move for a move in UCI notation (e2e4, e7e8q), raises ValueError if it is not legal
+    """
+    for move in game_state.legal_moves():
+        if move_to_uci(move) == text:
+            return move
+    raise ValueError("illegal move: " + text)
+
+
+def format_score(score):
+    # UCI score: centipawns, or mate in moves (negative when the engine is getting mated)
+    if abs(score) >= MATE_SCORE - MAX_PLY:
+        moves = (MATE_SCORE - abs(score) + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {score}"
+
+
+def time_limit(options, white_to_move):
+    """
+    Seconds to search a move for, from the options of a go command (None to search without a time limit)
+    """
+    if "movetime" in options:
+        return max(options["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+
+    remaining = options.get("wtime" if white_to_move else "btime")
+    if remaining is None:
+        return None
+
+    increment = options.get("winc" if white_to_move else "binc", 0)
+    moves_to_go = options.get("movestogo", MOVES_TO_GO)
+    limit = remaining / max(moves_to_go, 1) + increment * 0.8
+    # Never use more than half of what is left on the clock
+    return max(min(limit, remaining / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+
+class UCIEngine():
+    """
+    State of the engine between commands: the position, the transposition table and the running search
+    """
+
+    def __init__(self):
+        self.game_state = GameState.from_fen(START_FEN)
+        self.hash_mb = DEFAULT_SIZE_MB
+        self.table = TranspositionTable(self.hash_mb)
+        self.book = None # Polyglot opening book (BookFile option), None to always search
+        self.tablebases = None # Endgame tables (TablebasePath option)
+
+        self.searcher = None
+        self.search_thread = None
+        self.stop_event = threading.Event()
+        # Set when the best move may be sent, cleared while an infinite search or a ponder search has not been stopped
+        self.release = threading.Event()
+        self.ponder_time = None # Time limit that starts when the GUI sends ponderhit
+
+
+    def handle(self, line):
+        """
+        Handles one command line, returns False for quit
+        """
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+
+        if command == "uci":
+            send(f"id name {ENGINE_NAME}")
+            send(f"id author {ENGINE_AUTHOR}")
+            send(f"option name Hash type spin default {DEFAULT_SIZE_MB} min 1 max {MAX_HASH_MB}")
+            send("option name Ponder type check default false")
+            send("option name BookFile type string default <empty>")
+            send("option name TablebasePath type string default <empty>")
+            send("uciok")
+        elif command == "isready":
+            send("readyok")
+        elif command == "setoption":
+            self.set_option(args)
+        elif command == "ucinewgame":
+            self.stop()
+            self.table.clear()
+        elif command == "position":
+            self.stop()
+            self.set_position(args)
+        elif command == "go":
+            self.stop()
+            self.go(args)
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "quit":
+            self.stop()
+            return False
+        # Unknown commands are ignored, as the protocol asks
+
+        return True
+
+
+    def set_option(self, args):
+        # setoption name <name> value <value>
+        if "name" not in args:
+            return
+        value_index = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1:value_index]).lower()
+        value = " ".join(args[value_index + 1:])
+
+        if name == "hash":
+            self.stop()
+            try:
+                self.hash_mb = min(max(int(value), 1), MAX_HASH_MB)
+            except ValueError:
+                return
+            self.table = TranspositionTable(self.hash_mb)
+        elif name == "bookfile":
+            self.stop()
+            if self.book is not None:
+                self.book.close()
+                self.book = None
+            if value and value != "<empty>":
+                try:
+                    self.book = OpeningBook(value)
+                except OSError as error:
+                    send(f"info string cannot open book: {error}")
+        elif name == "tablebasepath":
+            self.stop()
+            if self.tablebases is not None:
+                self.tablebases.close()
+                self.tablebases = None
+            if value and value != "<empty>":
+                if os.path.isdir(value):
+                    self.tablebases = Tablebases(value)
+                else:
+                    send(f"info string no tablebase directory: {value}")
+
+
+    def set_position(self, args):
+        # position startpos|fen <fen> [moves ...], a position that cannot be read keeps the previous one
+        moves_index = args.index("moves") if "moves" in args else len(args)
+        try:
+            if args and args[0] == "fen":
+                game_state = GameState.from_fen(" ".join(args[1:moves_index]))
+            else:
+                game_state = GameState.from_fen(START_FEN)
+            for text in args[moves_index + 1:]:
+                game_state.make_move(parse_uci_move(game_state, text))
+        except (ValueError, KeyError, IndexError) as error:
+            send(f"info string bad position: {error}")
+            return
+
+        self.game_state = game_state
+
+
+    def go(self, args):
+        """
+        Starts a search in the search thread with the limits of the go command
+        """
+        options = {}
+        index = 0
+        while index < len(args):
+            word = args[index]
+            if word in ("infinite", "ponder"):
+                options[word] = True
+            elif word in ("depth", "nodes", "movetime", "wtime", "btime", "winc", "binc", "movestogo") and index + 1 < len(args):
+                try:
+                    options[word] = int(args[index + 1])
+                except ValueError:
+                    pass
+                index += 1
+            index += 1
+
+        # A book move is played at once, unless the GUI asked for a search that only ends on stop or ponderhit
+        if self.book is not None and "infinite" not in options and "ponder" not in options:
+            move = self.book.choose(self.game_state)
+            if move is not None:
+                send(f"bestmove {move_to_uci(move)}")
+                return
+
+        limit = time_limit(options, self.game_state.white_to_move)
+        self.ponder_time = None
+        if "ponder" in options:
+            # The clock only starts for the engine on ponderhit, until then the search runs on the opponent's time
+            self.ponder_time, limit = limit, None
+
+        self.stop_event.clear()
+        if "infinite" in options or "ponder" in options:
+            self.release.clear()
+        else:
+            self.release.set()
+
+        # The search plays on a copy, so a new position command never changes the state being searched
+        self.searcher = Searcher(self.game_state.copy(), info=self.send_info, table=self.table)
+        self.searcher.stop_event = self.stop_event
+        self.searcher.node_limit = options.get("nodes")
+        self.searcher.tablebases = self.tablebases
+        depth = options.get("depth")
+        if depth is None and ("infinite" in options or "ponder" in options or "nodes" in options):
+            # No depth limit, the search runs until it is stopped, runs out of nodes or (after ponderhit) out of time
+            depth = MAX_PLY
+        self.search_thread = threading.Thread(target=self.search, args=(depth, limit), daemon=True)
+        self.search_thread.start()
+
+
+    def search(self, depth, limit):
+        # Runs in the search thread
+        move, score, pv = self.searcher.search(depth, limit)
+
+        # In infinite and ponder mode the best move is only sent after stop or ponderhit
+        self.release.wait()
+        if move is None:
+            send("bestmove 0000")
+        elif len(pv) > 1:
+            send(f"bestmove {move_to_uci(move)} ponder {move_to_uci(pv[1])}")
+        else:
+            send(f"bestmove {move_to_uci(move)}")
+
+
+    def send_info(self, info):
+        send(f"info depth {info.depth} score {format_score(info.score)} nodes {info.nodes} nps {info.nps:.0f} "
+             f"time {info.time * 1000:.0f} hashfull {self.table.hashfull()} pv {' '.join(move_to_uci(move) for move in info.pv)}")
+
+
+    def stop(self):
+        # Ends the running search, its best move is sent by the search thread
+        # Commands that change the engine's state call it first, waiting for an infinite or ponder search would never end
+        self.stop_event.set()
+        self.release.set()
+        self.wait()
+
+
+    def ponderhit(self):
+        # The opponent played the expected move: the ponder search goes on as a normal search with the move's time limit
+        if self.searcher is not None and self.ponder_time is not None:
+            self.searcher.deadline = time.perf_counter() + self.ponder_time
+        self.ponder_time = None
+        self.release.set()
+
+
+    def wait(self):
+        # Waits for the running search (if any) to send its best move
+        if self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+
+def read_lines(stream, lines):
+    # Reader thread: puts every line of the stream in the queue, None at the end of the input
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+def main():
+    engine = UCIEngine()
+    lines = queue.Queue()
+    threading.Thread(target=read_lines, args=(sys.stdin, lines), daemon=True).start()
+
+    while True:
+        line = lines.get()
+        if line is None:
+            engine.stop()
+            break
+        if not engine.handle(line):
+            break
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())